@@ -1,6 +1,8 @@
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
+import os
+import sys
 
 from astropy.stats import mad_std
 from sklearn.model_selection import train_test_split
@@ -10,6 +12,9 @@ from sklearn.svm import SVR
 from sklearn.neighbors import KNeighborsRegressor
 from sklearn.gaussian_process import GaussianProcessRegressor
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Common'))
+from regressor_comparison import compare_regressors
+
 #Reads in dataframe
 sfile = 'spectra_dataframe.csv'
 df = pd.read_csv(sfile, sep=',')
@@ -43,6 +48,9 @@ classifiers = [RandomForestRegressor(),
                GaussianProcessRegressor(),
                SVR(kernel='rbf', gamma=0.1)]
 
+#Fits every regressor in parallel worker processes, giving up on any that take over 10 minutes
+table, predictions = compare_regressors(dict(zip(names, classifiers)), features_train, temp_train, features_test, temp_test, ['teff'], budget=600)
+print(table.to_string())
 
 fig, axes = plt.subplots(3,3,sharex=True,sharey=True)
 fig.suptitle('Regressor Comparison',y=1.03,fontsize=18)
@@ -51,16 +59,18 @@ fig.text(-0.01, 0.5, 'Predicted Temperature / K', va='center', rotation='vertica
 
 for i,ax in enumerate(axes.flatten()):
     
-    classifiers[i].fit(features_train,temp_train)
+    ax.set_title(names[i])
+    if (names[i], 'teff') not in predictions:
+        ax.annotate(table.status[i], xy=(0.05, 0.05), xycoords='axes fraction',color='r')
+        continue
     
-    test_pred = classifiers[i].predict(features_test)
+    test_pred = predictions[(names[i], 'teff')]
     
     error = test_pred - temp_test
 
     MAD = mad_std(error)
 
-    ax.scatter(temp_test, classifiers[i].predict(features_test))
-    ax.set_title(names[i])
+    ax.scatter(temp_test, test_pred)
     ax.set_ylim([3000,9000])
     ax.annotate('{0:.2f}'.format(MAD), xy=(0.63, 0.05), xycoords='axes fraction',color='r')
     
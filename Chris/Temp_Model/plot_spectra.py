@@ -3,9 +3,14 @@ import numpy as np
 from astropy.io import fits
 import glob
 import pandas as pd
+import os
+import sys
 from read_fits import Spectrum
 from matplotlib.lines import Line2D
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Common'))
+from catalog_store import read_catalog
+
 '''  MK: 361, 588, 143, 635, 561, 54, 1457     '''
 
 """
@@ -57,8 +62,7 @@ direc = 'TempCSVs1'
 
 features_df = pd.concat([pd.read_csv(f, sep=',') for f in glob.glob(direc + '/*.csv')])       
 catalog_file = "/data2/cpb405/dr1_stellar.csv"
-catalog = pd.read_csv(catalog_file, sep='|')
-catalog.drop_duplicates(subset = 'designation', inplace = True)
+catalog = read_catalog(catalog_file, ['designation', 'teff', 'logg'])
 df = catalog.merge(features_df, on='designation', how='inner')
 df = df.sort_values('cAll')[:1000]
 
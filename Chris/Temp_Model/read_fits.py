@@ -2,34 +2,48 @@
 
 import numpy as np
 import matplotlib.pyplot as plt
-import glob
-from astropy.io import fits
-from astropy.convolution import convolve, Box1DKernel
 import pandas as pd
+import os
 import sys
+import time
+import argparse
+from functools import partial
+from itertools import islice
+from multiprocessing import Pool
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Common'))
+from features import colour_features, line_features, smoothing_features, spectrum_features
+from spectrum_store import SpectrumStore
+from lamost_fits import read_rows, source_size, FLUX
+from spectrum_sources import Bounded, expand, find_sources, is_archive
+from feature_cache import FeatureCache, META
+from feature_sink import FeatureSink
+import instrument
+
+def feature_keys(fdict):
+    ''' Column names of the features produced for fdict '''
+    return list(fdict) + ['d1', 'd2', 'd3'] + META
 
 class Spectrum():
-    ''' A class to read in and process a fits file containing a LAMOST spectrum'''
+    ''' A class to read in and process a fits file containing a LAMOST spectrum (a .fits or .fits.gz path, or a member
+    of a tar archive) '''
     def __init__(self, fits_sfile, fdict={'cAll':[0,9000], 'cB':[3980, 4920], 'cV':[5070,5950]}):
         self.fits_sfile = fits_sfile
         self.fdict = fdict
-        keys = [n[0] for n in fdict.items()]
-        keys = keys + ['d1', 'd2', 'd3', 'FILENAME', 'designation', 'CLASS']
-        self.df = pd.DataFrame(columns=keys)
+        self.keys = feature_keys(fdict)
         self.read_fits_file()
         self.get_smoothing_features()
         
     def read_fits_file(self):
         ''' Read in and store the fits file data '''
-        hdulist = fits.open(self.fits_sfile)
-        self.flux = (hdulist[0].data)[0]
-        self.spec_class = hdulist[0].header['CLASS']
-        self.fname = hdulist[0].header['FILENAME']
-        self.designation = hdulist[0].header['DESIG'][7:]
-        init = hdulist[0].header['COEFF0']
-        disp = hdulist[0].header['COEFF1']
+        data, header = read_rows(self.fits_sfile, [FLUX])
+        self.flux = data[0]
+        self.spec_class = header['CLASS']
+        self.fname = header['FILENAME']
+        self.designation = header['DESIG'][7:]
+        init = self.coeff0 = header['COEFF0']
+        disp = self.coeff1 = header['COEFF1']
         self.wavelength = 10**(np.arange(init,init+disp*(len(self.flux)-0.9),disp))
-        hdulist.close()
     
     def process_fits_file(self):
         ''' Kills negative flux values and deals with echelle overlap region @ ~5580 A '''
@@ -40,59 +54,29 @@ class Spectrum():
         ''' Smoothes spectum using two different boxcar functions and finds differences '''
         w1 = 10
         w2 = 100
-        buff = 1      
-        smooth1 = convolve(self.flux,Box1DKernel(w1))[buff*w2:-buff*w2]
-        smooth2 = convolve(self.flux,Box1DKernel(w2))[buff*w2:-buff*w2]        
+        buff = 1
+        raw = np.array(self.flux, dtype=np.float64)
         self.process_fits_file()
-        total_flux = np.nanmean(self.flux)
-        self.d1 = np.nanmean(abs(self.flux[buff*w2:-buff*w2]-smooth1))/total_flux
-        self.d2 = np.nanmean(abs(self.flux[buff*w2:-buff*w2]-smooth2))/total_flux
-        self.d3 = np.nanmean(abs(smooth1-smooth2))/total_flux
+        self.d1, self.d2, self.d3 = smoothing_features(self.flux, (w1, w2), buff*w2, raw=raw)[0]
+
+    def get_row(self, verbose=False):
+        ''' Calculates colour indices of continuum and equivalent widths of spectral lines and returns them as a dictionary '''
+        colours = [feat for feat in self.fdict if feat[0]=='c']
+        lines = [feat for feat in self.fdict if feat[0]=='l']
+        feats = {}
+        if colours:
+            feats.update(zip(colours, colour_features(self.flux, self.coeff0, self.coeff1, [self.fdict[c] for c in colours])[0]))
+        if lines:
+            feats.update(zip(lines, line_features(self.flux, self.coeff0, self.coeff1, [self.fdict[l] for l in lines])[0]))
+        feats = [feats.get(feat, 0) for feat in self.fdict]
+        if verbose:
+            for feat, value in zip(self.fdict, feats):
+                print('Feature ' + feat + ' : ', value)
+        return dict(zip(self.keys, [*feats, self.d1, self.d2, self.d3, self.fname, self.designation, self.spec_class]))
 
     def get_features(self, verbose=False):
-        ''' Calculates colour indices of continuum and equivalent widths of spectral lines '''
-        feats = np.zeros(len(self.fdict))
-        i = 0
-        for feat, lam in self.fdict.items():
-            sel = np.where(np.logical_and(self.wavelength > lam[0], self.wavelength < lam[1]))[0]
-            if feat[0]=='c': 
-                feats[i] = -2.5*np.log10(np.nanmean(self.flux[sel]))
-                if feats[i] != feats[i] or feats[i] == np.inf or feats[i] == (-1)*np.inf:
-                    print(feats[i])                   
-                    feats[i] = 0
-                i += 1
-                if verbose:
-                    print('Feature ' + feat + ' : ', feats[i])
-            elif feat[0]=='l':
-                spec_line_width = self.wavelength[sel][-1]-self.wavelength[sel][0]
-                wSel = np.concatenate((self.wavelength[sel[0]-20:sel[0]],self.wavelength[sel[-1]:sel[-1]+20]))
-                fSel = np.concatenate((self.flux[sel[0]-20:sel[0]],self.flux[sel[-1]:sel[-1]+20]))
-                check_nan = np.logical_not(np.isnan(fSel))
-                fSel = fSel[check_nan]
-                wSel = wSel[check_nan]
-                
-                lin = np.polyfit(wSel,fSel,1)
-                '''
-                S = np.sum(1/fSel)
-                Sx = np.sum(wSel/fSel)
-                Sy = len(fSel)
-                Sxx = np.sum(wSel**2/fSel)
-                Sxy = np.sum(wSel)
-                
-                grad = S*Sxx - Sx**2
-                a = (Sxx*Sy - Sx*Sxy)/grad
-                b = (S*Sxy - Sx*Sy)/grad
-                '''
-                spec_line_area = np.trapz(self.flux[sel],self.wavelength[sel])
-                #continuum_area = (b*(self.wavelength[sel][0]+self.wavelength[sel][-1])+2*a) * spec_line_width/2   
-                continuum_area = (lin[0]*(self.wavelength[sel][0]+self.wavelength[sel][-1])+2*lin[1]) * spec_line_width/2  
-                feats[i] = (continuum_area-spec_line_area)/continuum_area * spec_line_width
-                if feats[i] != feats[i]:
-                    feats[i] = 0
-                i += 1
-                if verbose:
-                    print('Feature ' + feat + ' : ', feats[i])     
-        self.df.loc[len(self.df)] = [*feats, self.d1, self.d2, self.d3, self.fname, self.designation, self.spec_class]
+        ''' Returns the features as a one-row DataFrame '''
+        self.df = pd.DataFrame([self.get_row(verbose)], columns=self.keys)
         return self.df
         
     def plot_flux(self):
@@ -104,26 +88,121 @@ class Spectrum():
         ''' Calls helper functions in turn when instance of class is made '''
         return self.get_features()
         
+def extract_features(f, fdict):
+    ''' Worker function returning the feature row of one fits file, or None if the file cannot be processed '''
+    try:
+        return Spectrum(f, fdict).get_row()
+    except Exception:
+        return None
+
+def process_files(files, fdict, processes=None, chunksize=100, verbose=True, cache=None, sink=None):
+    ''' Spreads the feature extraction of files over a pool of worker processes and merges the results.
+    With a FeatureCache only new or changed files and new feature columns are computed, and with a FeatureSink
+    the rows are streamed to disk rather than returned. Without a cache, files may be any iterable of sources (such
+    as the generator of spectrum_sources.expand), which is read only a window of files ahead of the results '''
+    if cache is None:
+        groups = {tuple(fdict): files}
+    else:
+        todo = cache.plan(files)
+        groups = {}
+        for f, missing in todo.items():
+            groups.setdefault(tuple(missing), []).append(f)
+    window = 2*chunksize*(processes or os.cpu_count())
+    rows = []
+    failed = []
+    done = 0
+    t = time.time()
+    with Pool(processes) as pool, instrument.span('features'):
+        for missing, group in groups.items():
+            sub_fdict = {feat: fdict[feat] for feat in missing if feat in fdict}
+            sources = Bounded(group, window)
+            try:
+                for row in pool.imap(partial(extract_features, fdict=sub_fdict), sources, chunksize):
+                    source = sources.done()
+                    done += 1
+                    if instrument.enabled():
+                        instrument.count('files_read' if row is not None else 'files_failed')
+                        instrument.count('bytes_read', source_size(source))
+                    if row is None:
+                        failed.append(source)
+                        print("Failed for file : ", source)
+                        if cache is not None:
+                            cache.quarantine(source)
+                        elif sink is not None:
+                            sink.skip()
+                    elif cache is not None:
+                        cache.store(source, row)
+                    elif sink is not None:
+                        sink.append(row)
+                    else:
+                        rows.append(row)
+                    if cache is not None and done % chunksize == 0:
+                        cache.commit()
+                    if verbose and done % chunksize == 0:
+                        rate = done/(time.time() - t)
+                        print("Processed {} files, {:.1f} files/s".format(done, rate))
+            finally:
+                sources.close()
+    if verbose:
+        print("Processed {} files in {:.1f}s, {} failed".format(done, time.time() - t, len(failed)))
+    if cache is not None:
+        if verbose:
+            print("{} files unchanged or quarantined".format(len(files) - len(todo)))
+        cache.commit()
+        return cache.load(files), failed
+    if sink is not None:
+        return None, failed
+    return pd.DataFrame(rows, columns=feature_keys(fdict)), failed
+        
+def process_store(store_dir, fdict, chunk=10000, verbose=True):
+    ''' Computes the same features as Spectrum for every spectrum in a spectrum store, chunk rows at a time '''
+    store = SpectrumStore(store_dir)
+    keys = feature_keys(fdict)[:-len(META)]
+    dfs = []
+    t = time.time()
+    for start in range(0, len(store), chunk):
+        headers = store.headers.iloc[start:start+chunk]
+        with instrument.span('features'):
+            feats = spectrum_features(store.flux[start:start+chunk], headers['COEFF0'].values, headers['COEFF1'].values, fdict)
+        df = pd.DataFrame(feats, columns=keys)
+        df['FILENAME'] = headers['filename'].values
+        df['designation'] = headers['designation'].values
+        df['CLASS'] = headers['CLASS'].values
+        dfs.append(df)
+        if verbose:
+            print("Processed {} / {} spectra, {:.1f}s".format(start+len(headers), len(store), time.time() - t))
+    return pd.concat(dfs) if dfs else pd.DataFrame(columns=keys)
+
 if __name__ == "__main__":
-    sdir = '/data2/mrs493/DR1_3/'
-    files = glob.glob(sdir + '*.fits')
+    parser = argparse.ArgumentParser(description='Extracts colour, line and smoothing features from a directory of LAMOST fits files')
+    parser.add_argument('--sdir', default='/data2/mrs493/DR1_3/', help='directory of fits, fits.gz or tar files')
+    parser.add_argument('--store', default=None, help='spectrum store to read instead of the fits files in sdir')
+    parser.add_argument('--cache', default=None, help='feature cache database, so reruns only process new or changed files')
+    parser.add_argument('--output', default='TempCSVs3/output.csv', help='csv file for the merged features')
+    parser.add_argument('--processes', type=int, default=None, help='number of worker processes (default: all cores)')
+    parser.add_argument('--chunksize', type=int, default=100, help='number of files handed to a worker at a time')
+    parser.add_argument('--sink_chunk', type=int, default=1000, help='number of rows written to the output per checkpoint')
+    parser.add_argument('--trace', default=None, help='json file for a trace of the time spent in each stage')
+    args = parser.parse_args()
+    if args.trace:
+        instrument.enable(args.trace)
+    
     fdict = {'cAll':[0,9000], 'cB':[3980, 4920], 'cV':[5070,5950], 'cR':[5890,7270], 'cI':[7310,8810],
              'lHa':[6555,6575], 'lHb':[4855,4870], 'lHg':[4320,4370], 'lHd':[4093,4113], 'lHe':[3960,3980], 
              'lNa':[5885,5905], 'lMg':[5167,5187], 'lK':[3925,3945], 'lG':[4240,4260]}
-    if len(sys.argv) != 2:
-        print('Usage : ./read_fits.py index')
-    index = int(sys.argv[1])
-    batch = 100
-    print("Processing file numbers {} {}".format(index*batch, (index+1)*batch))
-    for idx, f in enumerate(files[index*batch:(index+1)*batch]):
-        try:
-            spec = Spectrum(f,fdict)
-            df = spec()
-            if idx == 0:
-                df_main = df.copy()
-            else:
-                df_main = pd.concat([df_main, df])
-        except:
-            print("Failed for file : ", f)
-    df_main.to_csv('TempCSVs3/output_' + str(index) + '.csv')
-
+    if args.store:
+        process_store(args.store, fdict).to_csv(args.output)
+    elif args.cache:
+        files = find_sources(args.sdir)
+        if any(is_archive(f) for f in files):
+            parser.error('--cache needs unpacked fits files, not tar archives')
+        df_main, failed = process_files(files, fdict, args.processes, args.chunksize, cache=FeatureCache(args.cache, fdict))
+        df_main.to_csv(args.output)
+    else:
+        files = expand(find_sources(args.sdir))
+        sink = FeatureSink(args.output, feature_keys(fdict), strings=META, chunk=args.sink_chunk, index=True)
+        start = sink.resume()
+        if start:
+            print("Resuming from file {}".format(start))
+        process_files(islice(files, start, None), fdict, args.processes, args.chunksize, sink=sink)
+        sink.close()
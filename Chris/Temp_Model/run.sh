@@ -1,6 +1,3 @@
 #!/bin/bash
 
-for i in {0..234..1};
-do
-    ./read_fits.py $i
-done
+./read_fits.py --chunksize 100 --output TempCSVs3/output.csv
@@ -4,6 +4,8 @@ import matplotlib
 import pandas as pd
 import seaborn as sns
 import glob
+import os
+import sys
 
 from astropy.stats import mad_std
 from sklearn.model_selection import train_test_split
@@ -12,52 +14,60 @@ from sklearn.ensemble import RandomForestRegressor
 from sklearn.preprocessing import Imputer, StandardScaler
 from read_fits import Spectrum
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Common'))
+from catalog_store import CatalogJoin
+from features import pairwise_features
+from blackbody import blackbody as blackbody_curves
+from rf_model import RegressorBundle, MultiTargetForest, load_bundle, predict_features
+from rf_tuning import HalvingSearch
+import instrument
+
 matplotlib.rcParams.update({'font.size':14})
 
 class Temperature_Regressor():
     def __init__(self, direc, bright = False):
         ''' Reads in dataframe and returns features as a 2D numpy array '''
-        features_df = pd.concat([pd.read_csv(f, sep=',') for f in glob.glob(direc + '/*.csv')])       
         catalog_file = "/data2/cpb405/dr1_stellar.csv"
-        catalog = pd.read_csv(catalog_file, sep='|')
-        catalog.drop_duplicates(subset = 'designation', inplace = True)
-        self.df = catalog.merge(features_df, on='designation', how='inner')
+        join = CatalogJoin(catalog_file, ['designation', 'teff', 'logg', 'feh'])
         if bright:
-            self.df = self.df.sort_values('cAll')[:1000]
-        self.names = self.df.columns[38:55]
-        imputer = Imputer(missing_values = 0)
-        self.df[self.names] = imputer.fit_transform(self.df[self.names])
+            self.df = join.merge(glob.glob(direc + '/*.csv'), sort = 'cAll', limit = 1000)
+        else:
+            self.df = join.merge(glob.glob(direc + '/*.csv'))
+        join.report()
+        first = len(join.columns) + 1
+        self.names = self.df.columns[first:first+17]
+        self.base_names = list(self.names)
+        instrument.count('features_imputed', int((self.df[self.names].values == 0).sum()))
+        self.imputer = Imputer(missing_values = 0)
+        self.df[self.names] = self.imputer.fit_transform(self.df[self.names])
+        self.scaler = None
+        self.models = {}
 
-    def tune_hyperparameters(self, feats, temps, verbose=False):
-        ''' Uses an exhaustive grid search to tune the hyperparameters of a random forest regressor '''
+    @instrument.timed('tune')
+    def tune_hyperparameters(self, feats, temps, verbose=False, halving=True):
+        ''' Tunes the hyperparameters of a random forest regressor by successive halving, or by an exhaustive grid search '''
         parameter_grid = [{'n_estimators':[20,40,60,80,100],'max_depth':[1000,2000,3000,4000,5000],'max_features':[6,9,12,15]}]
-        regr = GridSearchCV(RandomForestRegressor(), parameter_grid, cv=5)
+        if halving:
+            regr = HalvingSearch(parameter_grid, cv=5, verbose=verbose)
+        else:
+            regr = GridSearchCV(RandomForestRegressor(), parameter_grid, cv=5, n_jobs=-1)
         regr.fit(feats, temps)
         if verbose:
             print(regr.best_params_)
         return regr.best_params_
     
+    @instrument.timed('features')
     def extract_features(self):
         ''' Carries out feature engineering on the photometric and equivalent width features '''
-        features = self.df.as_matrix(columns = self.names)         
-        col_features = features[:,1:5]
-        col_names = self.names[1:5]
-        for idx in range(len(col_features.T)-1):
-            for j in np.arange(idx+1, len(col_features.T)):
-                d = np.reshape(col_features[:,idx] - col_features[:,j],(-1, 1))
-                n = col_names[idx][1:] + "-" + col_names[j][1:]
-                self.df[n] = d
-            self.names = np.append(self.names,[col_names[idx][1:] + "-" + i[1:] for i in col_names[idx+1:]])                     
-        lin_features = features[:,5:14]
-        lin_names = self.names[5:14]
-        for idx in range(len(lin_features.T)-1):
-            for j in np.arange(idx+1, len(lin_features.T)):
-                d = np.reshape(lin_features[:,idx] / lin_features[:,j],(-1,1))
-                n = lin_names[idx][1:] + "/" + lin_names[j][1:]
-                self.df[n] = d
-            self.names = np.append(self.names,[lin_names[idx][1:] + "/" + i[1:] for i in lin_names[idx+1:]])
-        scaler = StandardScaler()
-        self.df[self.names] = scaler.fit_transform(self.df[self.names])
+        features = self.df.as_matrix(columns = self.names)
+        col_features, col_names = pairwise_features(features[:,1:5], self.names[1:5], '-')
+        lin_features, lin_names = pairwise_features(features[:,5:14], self.names[5:14], '/')
+        self.scaler = StandardScaler()
+        scaled = self.scaler.fit_transform(np.hstack((features, col_features, lin_features)))
+        self.df[self.names] = scaled[:,:len(self.names)]
+        new = pd.DataFrame(scaled[:,len(self.names):], columns = col_names + lin_names, index = self.df.index)
+        self.df = pd.concat([self.df, new], axis=1)
+        self.names = np.append(self.names, col_names + lin_names)
                                  
     def predict_temperatures(self, model, tune=False, verbose=False):
         ''' Fits a regressor to the data and returns model predictions and true values of a test set '''
@@ -73,8 +83,11 @@ class Temperature_Regressor():
         else:
             self.max_features = 15
             regr = RandomForestRegressor(n_estimators=60, max_depth=5000, max_features=self.max_features)     
-        regr = regr.fit(X_train,y_train)        
-        self.y_test_pred = regr.predict(X_test)
+        with instrument.span('fit'):
+            regr = regr.fit(X_train,y_train)
+        self.models[model] = regr
+        with instrument.span('predict'):
+            self.y_test_pred = regr.predict(X_test)
         self.error = self.y_test_pred - self.y_test
         self.importances = regr.feature_importances_
         if verbose:
@@ -82,15 +95,51 @@ class Temperature_Regressor():
                 print("Importances:")
                 print(self.names[i] + ' : ', self.importances[i])
     
+    def predict_parameters(self, models, tune=False, verbose=False):
+        ''' Fits one forest to all the parameters in models at once, keeping the test predictions, errors and
+        importances of each for use_results '''
+        train_df, self.test_df = train_test_split(self.df,test_size=0.5)
+        X_train = train_df.as_matrix(columns = self.names)
+        X_test = self.test_df.as_matrix(columns = self.names)
+        y_train = train_df[models].values
+        y_test = self.test_df[models].values
+        if tune:
+            hyp = self.tune_hyperparameters(X_train, (y_train - y_train.mean(axis=0))/y_train.std(axis=0), True)
+            self.max_features = hyp['max_features']
+            regr = MultiTargetForest(models, n_estimators = hyp['n_estimators'], max_depth = hyp['max_depth'], max_features = self.max_features)
+        else:
+            self.max_features = 15
+            regr = MultiTargetForest(models, n_estimators=60, max_depth=5000, max_features=self.max_features)
+        with instrument.span('fit'):
+            regr = regr.fit(X_train, y_train)
+        self.models[tuple(models)] = regr
+        with instrument.span('predict'):
+            y_test_pred = regr.predict(X_test)
+        with instrument.span('importances'):
+            importances = regr.target_importances(X_test, y_test)
+        self.results = {}
+        for i, model in enumerate(models):
+            self.results[model] = (y_test[:,i], y_test_pred[:,i], importances[:,i])
+            if verbose:
+                print(model + ' MAD : ', mad_std(y_test_pred[:,i] - y_test[:,i]))
+                for j in np.argsort(importances[:,i])[::-1][:self.max_features]:
+                    print('  ' + self.names[j] + ' : ', importances[j,i])
+
+    def use_results(self, model):
+        ''' Selects the test predictions of one parameter of predict_parameters for plot_results '''
+        self.y_test, self.y_test_pred, self.importances = self.results[model]
+        self.error = self.y_test_pred - self.y_test
+
+    @instrument.timed('save')
+    def save_model(self, path):
+        ''' Saves the imputer, scaler, feature list and the regressor fitted to each parameter as one bundle '''
+        RegressorBundle(self.imputer, self.scaler, self.base_names, self.base_names[1:5], self.base_names[5:14], self.models).save(path)
+
     def blackbody(self, T, wavelength, counts):
-        ''' Models an ideal blackbody curve of a given temperature '''
-        h = 6.63e-34
-        c = 3e8
-        k = 1.38e-23
-        E = (8*np.pi*h*c)/((wavelength*1e-10)**5*(np.exp(h*c/((wavelength*1e-10)*k*T))-1))
-        normalise = counts/np.sum(E)
-        return normalise*E
+        ''' Models an ideal blackbody curve of a given temperature, normalised to the total counts '''
+        return blackbody_curves(T, wavelength, counts)[0]
 
+    @instrument.timed('plot')
     def plot_results(self, model, regr='Random Forest Regressor'):
         ''' Creates a 2 by 2 grid of subplots presenting the predictions of the RFR '''
         fig, ax = plt.subplots(2,2, figsize=[13,10])
@@ -147,13 +196,26 @@ class Temperature_Regressor():
         plt.show()
         	
 if __name__ == "__main__":
+    # ./temperature_regressor.py model.pkl features.csv output.csv [n_jobs] predicts with a saved model
+    if len(sys.argv) in [4, 5]:
+        predict_features(load_bundle(sys.argv[1]), sys.argv[2], sys.argv[3], n_jobs = int(sys.argv[4]) if len(sys.argv) == 5 else -1)
+        sys.exit()
+
     direc = 'TempCSVs1'
     spec_regr = Temperature_Regressor(direc, bright = True)
     spec_regr.extract_features()
 
     models = ['teff', 'logg', 'feh']
     names = ['Temperature', 'Surface Gravity', 'Metallicity']
+    # set to True to fit one forest for all three parameters rather than one each
+    multi = False
+    if multi:
+        spec_regr.predict_parameters(models, tune = False)
     for idx in range(len(models)):
-        spec_regr.predict_temperatures(tune = False, model = models[idx])
+        if multi:
+            spec_regr.use_results(models[idx])
+        else:
+            spec_regr.predict_temperatures(tune = False, model = models[idx])
         spec_regr.plot_results(model = names[idx])
+    spec_regr.save_model('temperature_regressor.pkl')
 
@@ -1,11 +1,21 @@
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import LabelEncoder, OneHotEncoder
-from astropy.io import fits
-import glob
 import time
+import os
+import sys
 import numpy as np
 import tensorflow as tf
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Common'))
+from spectrum_store import SpectrumStore, is_store
+from spectrum_sources import read_sources, find_sources
+from shard_stream import ShardStream, store_shards
+from batch_sampler import BatchSampler
+from chunked_eval import ChunkedEvaluator
+import synthetic
+from blackbody import planck
+import instrument
+
 """
 CLASS --- TOTAL --- TRAINING
 A --- 275405 --- 1123
@@ -26,22 +36,27 @@ WD --- 9855 --- 1700
 """
 class Neural_Net():
     def __init__(self):
-        pass
+        self.shards = None
     
+    @instrument.timed('read')
     def read_lamost_data(self,sfile,MK = False):
-        ''' Reads in the flux and classes from LAMOST fits files & converts classes to one-hot vectors '''
+        ''' Reads in the flux and classes from LAMOST fits, fits.gz or tar files (or a spectrum store directory) & converts classes to one-hot vectors '''
         print("Reading in LAMOST data...")
         flux = []
         scls = []
         self.wav = 3500
-        for idx, file in enumerate(sfile):
-            with fits.open(file) as hdulist:
-                f = hdulist[0].data[0]
-                f = f[:self.wav]
-                f = f/np.sum(f)
-                s = hdulist[0].header['CLASS']
-                if MK and s == 'STAR':
-                    s = hdulist[0].header['SUBCLASS'][0]
+        if is_store(sfile):
+            store = SpectrumStore(sfile)
+            flux = store.get_flux(pixels=self.wav)
+            scls = store.get_classes(MK=MK)
+            sfile = []
+        for idx, (file, data, header) in enumerate(read_sources(sfile)):
+            f = data[0]
+            f = f[:self.wav]
+            f = f/np.sum(f)
+            s = header['CLASS']
+            if MK and s == 'STAR':
+                s = header['SUBCLASS'][0]
             flux.append(f)
             scls.append(s)
             
@@ -60,30 +75,37 @@ class Neural_Net():
         self.fluxTR, self.fluxTE, self.clsTR, self.clsTE = train_test_split(flux, cls, test_size=0.5)
         print("LAMOST data successfully read in...")
         
+    @instrument.timed('shard')
+    def shard_lamost_data(self, store_dir, shard_dir, MK = False):
+        ''' Writes a random half of a spectrum store to shards on disk for training and reads the other half into memory for testing '''
+        print("Sharding LAMOST data...")
+        self.wav = 3500
+        store = SpectrumStore(store_dir)
+        rows = np.random.permutation(len(store))
+        scls = store.get_classes(rows, MK)
+        label_encoder = LabelEncoder()
+        int_encoded = label_encoder.fit_transform(scls)
+        self.labels = label_encoder.inverse_transform(np.arange(np.amax(int_encoded)+1))
+        half = len(rows)//2
+        self.train_samples = store_shards(store, rows[half:], int_encoded[half:], len(self.labels), shard_dir, self.wav)
+        self.shards = shard_dir
+        self.fluxTE = store.get_flux(rows[:half], self.wav)
+        self.clsTE = np.eye(len(self.labels))[int_encoded[:half]]
+        print("LAMOST data successfully sharded...")
+        
+    @instrument.timed('generate')
     def create_artificial_data(self,nStars,nGalaxies):
         ''' Creates a set of artificial stars (modelled as blackbodies) and galaxies (modelled as straight lines) '''
         print("Generating artificial data...")
         self.MKClasses = ['B-type','A-type','F-type','G-type','K-type','M-type']
         self.MKTemps = [10000,7500,6000,5200,3700,2400]
-        fStar = []
-        cStar = []
         self.wav = 1000
         temps = np.random.uniform(2400,15000,nStars)
         wavelength = np.linspace(4000,9000,self.wav)
-        for idx in range(nStars):
-            flux, cls = self.blackbody(temps[idx], wavelength)
-            fStar.append(flux)
-            cStar.append(cls)
-        fStar = np.array(fStar)
-        cStar = np.array(cStar)
+        fStar, cStar = self.blackbody(temps, wavelength)
 
-        fGalaxy = []
-        cGalaxy = []
-        for idx in range(nGalaxies):
-            fGalaxy.append(self.line())
-            cGalaxy.append('Galaxy')
-        fGalaxy = np.array(fGalaxy)
-        cGalaxy = np.array(cGalaxy)
+        fGalaxy = self.line(nGalaxies)
+        cGalaxy = np.array(['Galaxy']*nGalaxies)
 
         self.flux = np.concatenate((fStar,fGalaxy))
         self.scls = np.concatenate((cStar,cGalaxy))
@@ -92,10 +114,11 @@ class Neural_Net():
         self.fluxTR, self.fluxTE, self.clsTR, self.clsTE = train_test_split(self.flux, self.cls, test_size=0.5)
         print("Artificial data created.")
     
-    def convolution(self, steps, pool_width=15):
+    @instrument.timed('fit')
+    def convolution(self, steps, pool_width=15, stratified=False, eval_samples=None, eval_chunk=1000):
         ''' Sets up a 1D convolutional multi-layered neural net '''
         print("Performing 1D convolution...")
-        n_classes = len(self.clsTR[0])
+        n_classes = len(self.clsTE[0])
         x = tf.placeholder(tf.float32, [None, self.wav])
         x_ = tf.reshape(x,[-1,self.wav,1])  
         y_ = tf.placeholder(tf.float32, [None, n_classes])
@@ -152,26 +175,38 @@ class Neural_Net():
         cross_entropy = tf.reduce_mean(tf.nn.softmax_cross_entropy_with_logits(labels=y_, logits=y_conv))
         train_step = tf.train.AdamOptimizer(1e-4).minimize(cross_entropy)
        
-        correct_prediction = tf.equal(tf.argmax(y_conv, 1), tf.argmax(y_, 1))         
-        accuracy = tf.reduce_mean(tf.cast(correct_prediction, tf.float32))
+        prediction = tf.argmax(y_conv, 1)
         
         self.accuracy = []
-        confusion = tf.confusion_matrix(tf.argmax(y_conv,1), tf.argmax(y_,1))
+        ''' Accuracy checks run over the test set in chunks of eval_chunk, the periodic ones on a fixed subsample of eval_samples spectra (all if None) '''
+        evaluator = ChunkedEvaluator(self.fluxTE, self.clsTE, n_classes, eval_chunk, eval_samples)
+        
+        if self.shards is not None:
+            batches = ShardStream(self.shards, max(1, int(0.01*self.train_samples)))
+        else:
+            batches = BatchSampler(self.fluxTR, self.clsTR, max(1, int(0.01*len(self.fluxTR))), stratified)
         
         with tf.Session() as sess:
             t = time.time()
             sess.run(tf.global_variables_initializer())
             for i in range(steps):
-                batch = np.random.random(len(self.fluxTR)) < 0.01
+                with instrument.span('batch'):
+                    batch_x, batch_y = next(batches)
                 if i % 50 == 0:
-                    train_accuracy = accuracy.eval(feed_dict={x: self.fluxTE, y_: self.clsTE, keep_prob: 1.0})
+                    with instrument.span('evaluate'):
+                        train_accuracy = evaluator.evaluate(lambda xc: prediction.eval(feed_dict={x: xc, keep_prob: 1.0}))[0]
                     print('Step %d, Training Accuracy %g' % (i, train_accuracy))
                     self.accuracy.append(train_accuracy)
-                train_step.run(feed_dict={x: self.fluxTR[batch], y_: self.clsTR[batch], keep_prob: 0.5})         
-            self.conf = sess.run(confusion, feed_dict={x: self.fluxTE, y_: self.clsTE, keep_prob: 1.0})
-            print('Test Accuracy %g' % accuracy.eval(feed_dict={x: self.fluxTE, y_: self.clsTE, keep_prob: 1.0}))
+                with instrument.span('train_step'):
+                    train_step.run(feed_dict={x: batch_x, y_: batch_y, keep_prob: 0.5})
+            with instrument.span('evaluate'):
+                test_accuracy, self.conf, _ = evaluator.evaluate(lambda xc: prediction.eval(feed_dict={x: xc, keep_prob: 1.0}), full=True)
+            print('Test Accuracy %g' % test_accuracy)
             print('Time Taken: ', (time.time() - t)/3600, 'hours')
+        if self.shards is not None:
+            batches.close()
     
+    @instrument.timed('save')
     def save(self,folder):
         ''' Saves final results from neural net into csv files '''
         print("Saving results...")
@@ -180,26 +215,15 @@ class Neural_Net():
         np.savetxt('Files/' + folder + '/Labels.csv', self.labels, fmt='%s', delimiter=',')
         
     def blackbody(self, T, wavelength):
-        ''' Models an ideal blackbody curve of a given temperature '''
-        h = 6.63e-34
-        c = 3e8
-        k = 1.38e-23
-        E = (8*np.pi*h*c)/((wavelength*1e-10)**5*(np.exp(h*c/((wavelength*1e-10)*k*T))-1))      
-        for idx in range(len(E)):
-            E[idx] = E[idx] + np.random.normal(0,np.sqrt(E[idx]*100))      
-        for idx in range(len(self.MKTemps)):
-            if T > self.MKTemps[idx]:
-                cls = self.MKClasses[idx]
-                break           
-        return E/np.sum(E), cls
+        ''' Models noisy ideal blackbody curves of an array of temperatures, returning them with their MK classes '''
+        E = synthetic.poisson_noise(planck(T, wavelength), 100)
+        cls = np.array(self.MKClasses)[synthetic.temperature_class(T, self.MKTemps, strict=True)]
+        return synthetic.normalise(E), cls
     
-    def line(self):
-        ''' Models a galaxy as a straight line '''
-        y = np.abs(np.random.random(2))
-        E = np.linspace(y[0],y[1],1000)
-        for idx in range(len(E)):
-            E[idx] = E[idx] + np.ranpoolsdom.normal(0,np.sqrt(E[idx]/1000))
-        return E/np.sum(E)
+    def line(self, n=1):
+        ''' Models n galaxies as noisy straight lines '''
+        E = synthetic.lines(np.abs(np.random.random((n, 2))), np.arange(1000))
+        return synthetic.normalise(synthetic.poisson_noise(E, 1/1000))
     
     def onehot(self,classes):
         ''' Encodes a list of descriptive labels as one hot vectors '''
@@ -231,7 +255,7 @@ class Neural_Net():
         
 if __name__ == "__main__":
     sdir = '/data2/cpb405/Training/'
-    files = glob.glob(sdir + '*.fits')
+    files = find_sources(sdir)
     
     NN = Neural_Net()
     NN.read_lamost_data(files, MK=False)
@@ -0,0 +1,78 @@
+''' Mini-batch sampling for the in-memory training sets of the neural nets: a fresh random permutation of the rows
+each epoch, cut into batches of a fixed size, so every row is seen once per epoch and each step costs O(batch) '''
+
+import numpy as np
+
+class BatchSampler():
+    ''' An endless iterator of (x, y) batches of batch_size rows. In stratified mode every batch holds each class
+    (the argmax of one-hot y, or y itself) in proportion to its share of the training set, each class cycling
+    through its own permutation (epoch then counts passes through the largest class) '''
+    def __init__(self, x, y, batch_size, stratified=False, seed=None):
+        self.x = x
+        self.y = y
+        self.batch_size = min(batch_size, len(x))
+        self.rng = np.random.RandomState(seed)
+        self.epoch = 0
+        self.stratified = stratified
+        if stratified:
+            labels = np.argmax(y, axis=1) if np.ndim(y) == 2 else np.asarray(y)
+            self.members = [np.where(labels == c)[0] for c in np.unique(labels)]
+            self.share = np.array([len(m) for m in self.members])*self.batch_size/len(labels)
+            self.credit = np.zeros(len(self.members))
+            self.orders = [self.rng.permutation(m) for m in self.members]
+            self.cursors = [0]*len(self.members)
+            self.largest = np.argmax(self.share)
+        else:
+            self.order = self.rng.permutation(len(x))
+            self.cursor = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        idx = self._stratified() if self.stratified else self._draw()
+        return self.x[idx], self.y[idx]
+
+    def _permute(self, rows, taken):
+        ''' A new permutation of rows with those already taken by the current batch moved to the end, so that a batch
+        spanning two epochs never holds the same row twice '''
+        order = self.rng.permutation(rows)
+        last = np.isin(order, taken)
+        return np.concatenate((order[~last], order[last]))
+
+    def _draw(self):
+        ''' The next batch_size rows of the epoch, starting a new permutation when the current one runs out '''
+        if self.cursor + self.batch_size > len(self.order):
+            tail = self.order[self.cursor:]
+            self.order = np.concatenate((tail, self._permute(len(self.x), tail)))
+            self.cursor = 0
+            self.epoch += 1
+        idx = self.order[self.cursor:self.cursor+self.batch_size]
+        self.cursor += self.batch_size
+        return idx
+
+    def _stratified(self):
+        ''' Splits the batch between the classes, carrying the fractional part of each class's share over to the
+        next batch so the proportions hold exactly over many batches '''
+        self.credit += self.share
+        take = np.floor(self.credit).astype(int)
+        short = self.batch_size - take.sum()
+        if short > 0:
+            take[np.argsort(take - self.credit)[:short]] += 1
+        self.credit -= take
+        return np.concatenate([self._draw_class(c, n) for c, n in enumerate(take) if n])
+
+    def _draw_class(self, c, n):
+        idx = []
+        while n:
+            order, cursor = self.orders[c], self.cursors[c]
+            if cursor == len(order):
+                self.orders[c] = order = self._permute(self.members[c], np.concatenate(idx) if idx else [])
+                cursor = 0
+                if c == self.largest:
+                    self.epoch += 1
+            step = min(n, len(order) - cursor)
+            idx.append(order[cursor:cursor+step])
+            self.cursors[c] = cursor + step
+            n -= step
+        return np.concatenate(idx)
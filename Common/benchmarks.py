@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+
+''' Benchmarks of the ingest, feature extraction and training steps of the project, run on the spectra bundled in
+SampleFits/ and the Data/my_data3.csv table, with the results written as JSON so that each optimisation can be
+measured against a baseline run:
+
+    ./benchmarks.py results.json [--repeat 3] [--only fits_open,rf] [--baseline baseline.json]
+
+Each benchmark is timed repeat times and reports the best and median wall time of each step, with per-spectrum
+or per-row rates; a benchmark that cannot run here (e.g. train_conv without TensorFlow) is recorded as skipped '''
+
+import os
+import sys
+import json
+import glob
+import time
+import gzip
+import shutil
+import argparse
+import platform
+import tempfile
+import tarfile
+import subprocess
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SAMPLE_FITS = os.path.join(ROOT, 'SampleFits')
+TABLE = os.path.join(ROOT, 'Data', 'my_data3.csv')
+
+sys.path.append(os.path.join(ROOT, 'Chris', 'Temp_Model'))
+sys.path.append(os.path.join(ROOT, 'Matt', 'RegressorRF'))
+sys.path.append(os.path.join(ROOT, 'Matt', 'ClassifierNN'))
+
+from lamost_fits import read_spectrum, read_header_cards, read_native, map_rows, FLUX, IVAR, USED_CARDS
+from features import spectrum_features, pairwise_features
+from spectrum_store import build_store, SpectrumStore
+from spectrum_sources import read_sources
+from catalog_store import build_catalog, CatalogJoin
+
+# the feature set of read_fits.py
+FDICT = {'cAll':[0,9000], 'cB':[3980, 4920], 'cV':[5070,5950], 'cR':[5890,7270], 'cI':[7310,8810],
+         'lHa':[6555,6575], 'lHb':[4855,4870], 'lHg':[4320,4370], 'lHd':[4093,4113], 'lHe':[3960,3980],
+         'lNa':[5885,5905], 'lMg':[5167,5187], 'lK':[3925,3945], 'lG':[4240,4260]}
+TABLE_FEATURES = ['totalCounts', 'B', 'V', 'R', 'I', 'Ha', 'Hb', 'Hg']
+PARAMETERS = ['teff', 'logg', 'feh']
+# the size of a full survey catalogue, which the table's catalogue is padded to for the survey scale join
+SURVEY_ROWS = 1000000
+
+class Timer():
+    ''' Times named steps over repeated runs and summarises them '''
+    def __init__(self):
+        self.times = {}
+
+    def time(self, name, fn, *args, **kwargs):
+        ''' Calls fn, recording its wall time under name, and returns its result '''
+        t = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self.times.setdefault(name, []).append(time.perf_counter() - t)
+        return result
+
+    def summary(self, counts={}):
+        ''' The best and median time of each step, with a rate for steps given a count of items '''
+        out = {}
+        for name, times in self.times.items():
+            out[name] = {'best': min(times), 'median': float(np.median(times)), 'runs': len(times)}
+            if name in counts:
+                out[name]['items'] = int(counts[name])
+                out[name]['per_item'] = min(times)/int(counts[name])
+                out[name]['per_second'] = int(counts[name])/min(times)
+        return out
+
+def sample_files(limit=None):
+    ''' The bundled sample fits files, in name order '''
+    return sorted(glob.glob(os.path.join(SAMPLE_FITS, '*.fits')))[:limit]
+
+def read_all(files):
+    ''' The flux matrix and header table of files, as the batch code sees them '''
+    spectra = [read_spectrum(f) for f in files]
+    pixels = min(len(flux) for flux, _ in spectra)
+    return np.array([flux[:pixels] for flux, _ in spectra]), pd.DataFrame([row for _, row in spectra])
+
+def bench_fits_open(repeat):
+    ''' Opening and parsing each fits file: astropy data and header access, the shared reader, the native reader for
+    one and two rows, memory-mapping and header-only reads '''
+    from astropy.io import fits
+    files = sample_files()
+    timer = Timer()
+
+    def astropy_open():
+        for f in files:
+            with fits.open(f) as hdulist:
+                np.array(hdulist[0].data[0])
+                hdulist[0].header['COEFF0']
+
+    for _ in range(repeat):
+        timer.time('astropy_open', astropy_open)
+        timer.time('read_spectrum', lambda: [read_spectrum(f) for f in files])
+        timer.time('read_native', lambda: [read_native(f) for f in files])
+        timer.time('read_native_flux_ivar', lambda: [read_native(f, [FLUX, IVAR]) for f in files])
+        timer.time('map_rows', lambda: [np.array(map_rows(f)[0][FLUX]) for f in files])
+        timer.time('read_header_cards', lambda: [read_header_cards(f, USED_CARDS) for f in files])
+    return timer.summary({name: len(files) for name in timer.times})
+
+def bench_sources(repeat):
+    ''' Reading the spectra straight from compressed sources: .fits.gz files and a tar archive of them, serially and
+    in threads, against the unpacked fits files '''
+    files = sample_files()
+    timer = Timer()
+    tmp = tempfile.mkdtemp()
+    try:
+        gz_files = []
+        for f in files:
+            gz_files.append(os.path.join(tmp, os.path.basename(f) + '.gz'))
+            with open(f, 'rb') as src, gzip.open(gz_files[-1], 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+        archive = os.path.join(tmp, 'spectra.tar')
+        with tarfile.open(archive, 'w') as tar:
+            for f in gz_files:
+                tar.add(f, os.path.basename(f))
+        for _ in range(repeat):
+            timer.time('fits', lambda: list(read_sources(files, threads=1)))
+            timer.time('fits_gz', lambda: list(read_sources(gz_files, threads=1)))
+            timer.time('fits_gz_threads', lambda: list(read_sources(gz_files)))
+            timer.time('tar_threads', lambda: list(read_sources([archive])))
+    finally:
+        shutil.rmtree(tmp)
+    return timer.summary({name: len(files) for name in timer.times})
+
+def bench_spectrum(repeat):
+    ''' Per-spectrum feature extraction with the read_fits.Spectrum and fits.Spectrum classes '''
+    files = sample_files()
+    timer = Timer()
+    from read_fits import Spectrum as TempSpectrum
+    for _ in range(repeat):
+        timer.time('read_fits.Spectrum', lambda: [TempSpectrum(f, FDICT).get_row() for f in files])
+    errors = {}
+    try:
+        from fits import Spectrum as RFSpectrum
+        for _ in range(repeat):
+            timer.time('fits.Spectrum', lambda: [RFSpectrum(f) for f in files])
+    except Exception as e:
+        errors['fits.Spectrum'] = {'error': repr(e)}
+    return dict(timer.summary({name: len(files) for name in timer.times}), **errors)
+
+def bench_batch_features(repeat):
+    ''' Packing the spectra into a spectrum store and batch feature extraction from the flux matrix '''
+    files = sample_files()
+    flux, headers = read_all(files)
+    timer = Timer()
+    tmp = tempfile.mkdtemp()
+    try:
+        for r in range(repeat):
+            store_dir = os.path.join(tmp, 'store{}'.format(r))
+            timer.time('build_store', build_store, files, store_dir, verbose=False)
+            store = SpectrumStore(store_dir)
+            timer.time('store_get_flux', store.get_flux)
+            timer.time('spectrum_features', spectrum_features, flux, headers['COEFF0'].values, headers['COEFF1'].values, FDICT)
+    finally:
+        shutil.rmtree(tmp)
+    return timer.summary({name: len(files) for name in timer.times})
+
+def survey_catalog(table, rows):
+    ''' The table's catalogue padded with made up designations to rows rows, shuffled '''
+    pad = rows - len(table)
+    rng = np.random.RandomState(0)
+    filler = pd.DataFrame({'designation': np.char.add('FILLER', np.arange(pad).astype(str)).astype(object)})
+    for col in PARAMETERS:
+        filler[col] = rng.choice(table[col].values, pad)
+    catalog = pd.concat([table[['designation'] + PARAMETERS], filler], ignore_index=True)
+    return catalog.iloc[rng.permutation(len(catalog))]
+
+def bench_catalog(repeat):
+    ''' Converting a catalogue to a catalogue store and joining a feature table against it, with the equivalent
+    pandas read and merge for comparison, for the table's own catalogue and for one of survey size (where the store,
+    built once, is read only at the joined rows while pandas reads the whole csv on every join) '''
+    table = pd.read_csv(TABLE, index_col=0)
+    timer = Timer()
+    tmp = tempfile.mkdtemp()
+    try:
+        catalog = os.path.join(tmp, 'catalog.csv')
+        survey = os.path.join(tmp, 'survey.csv')
+        feats = os.path.join(tmp, 'features.csv')
+        table[['designation'] + PARAMETERS].to_csv(catalog, sep='|', index=False)
+        survey_catalog(table, SURVEY_ROWS).to_csv(survey, sep='|', index=False)
+        table[['designation'] + TABLE_FEATURES].to_csv(feats, index=False)
+        for r in range(repeat):
+            for name, csv in [('', catalog), ('_survey', survey)]:
+                store_dir = os.path.join(tmp, 'catalog{}{}.catalog'.format(name, r))
+                timer.time('build_catalog' + name, build_catalog, csv, store_dir, verbose=False)
+                join = CatalogJoin(store_dir, ['designation'] + PARAMETERS)
+                timer.time('catalog_join' + name, join.merge, feats)
+                timer.time('pandas_merge' + name, lambda: pd.read_csv(csv, sep='|').merge(pd.read_csv(feats), on='designation'))
+    finally:
+        shutil.rmtree(tmp)
+    counts = {name: len(table) for name in timer.times}
+    counts['build_catalog_survey'] = SURVEY_ROWS
+    return timer.summary(counts)
+
+def table_features():
+    ''' The scaled features and stellar parameters of the rows of Data/my_data3.csv with all of them '''
+    from sklearn.preprocessing import StandardScaler
+    table = pd.read_csv(TABLE, index_col=0).dropna(subset=TABLE_FEATURES + PARAMETERS)
+    values = table[TABLE_FEATURES].values
+    diffs = pairwise_features(values[:, 1:5], TABLE_FEATURES[1:5], '-')[0]
+    X = StandardScaler().fit_transform(np.hstack((values, diffs)))
+    return X, table[PARAMETERS].values
+
+def bench_rf(repeat):
+    ''' Random forest fit and prediction of teff, and of all three parameters with one multi-output forest '''
+    from sklearn.ensemble import RandomForestRegressor
+    from rf_model import MultiTargetForest
+    X, Y = table_features()
+    train = np.arange(len(X)) % 5 != 0
+    timer = Timer()
+    for r in range(repeat):
+        regr = timer.time('rf_fit_teff', RandomForestRegressor(n_estimators=60, max_features=6, random_state=r).fit, X[train], Y[train, 0])
+        timer.time('rf_predict_teff', regr.predict, X[~train])
+        multi = MultiTargetForest(PARAMETERS, n_estimators=60, max_features=6, random_state=r)
+        timer.time('rf_fit_multi', multi.fit, X[train], Y[train])
+        timer.time('rf_predict_multi', multi.predict, X[~train])
+    counts = {name: np.sum(train) if 'fit' in name else np.sum(~train) for name in timer.times}
+    return timer.summary(counts)
+
+def bench_train_conv(repeat, steps=50, samples=2000):
+    ''' Neural_Network.train_conv on synthetic spectra: a run of steps training steps and a run of one, whose
+    difference gives the cost per step without graph construction and evaluation '''
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        from model_NN import Neural_Network
+    except ImportError as e:
+        return {'skipped': repr(e)}
+    timer = Timer()
+    cwd = os.getcwd()
+    tmp = tempfile.mkdtemp()
+    try:
+        os.chdir(tmp)
+        os.makedirs(os.path.join('Files', 'benchmark'))
+        conv = {'folder':'benchmark', 'batch_frac':0.01, 'keep':0.5, 'record':steps, 'pw0':4, 'pw1':10, 'pw2':10,
+                'width1':50, 'width2':50, 'inter1':32, 'inter2':64, 'inter3':1000}
+        for _ in range(repeat):
+            import tensorflow as tf
+            NN = Neural_Network()
+            timer.time('make_spectra', NN.make_spectra, samples, 1./8.)
+            NN.train_test_split(0.5)
+            for train_steps in [1, steps]:
+                tf.reset_default_graph()
+                timer.time('train_conv_{}'.format(train_steps), NN.train_conv, train_steps=train_steps, **conv)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp)
+    out = timer.summary({'make_spectra': samples})
+    out['per_step'] = (out['train_conv_{}'.format(steps)]['best'] - out['train_conv_1']['best'])/(steps - 1)
+    return out
+
+BENCHMARKS = [('fits_open', bench_fits_open),
+              ('sources', bench_sources),
+              ('spectrum', bench_spectrum),
+              ('batch_features', bench_batch_features),
+              ('catalog', bench_catalog),
+              ('rf', bench_rf),
+              ('train_conv', bench_train_conv)]
+
+def environment():
+    ''' The versions and machine a run was made with, so that results are only compared like for like '''
+    import sklearn
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': commit, 'python': platform.python_version(),
+            'numpy': np.__version__, 'pandas': pd.__version__, 'sklearn': sklearn.__version__,
+            'machine': platform.machine(), 'processor': platform.processor(), 'cpus': os.cpu_count()}
+
+def run(names=None, repeat=3, verbose=True):
+    ''' Runs the named benchmarks (all by default), returning the results with the environment '''
+    results = {'environment': environment(), 'repeat': repeat, 'benchmarks': {}}
+    for name, bench in BENCHMARKS:
+        if names and name not in names:
+            continue
+        if verbose:
+            print('running ' + name + '...')
+        t = time.time()
+        try:
+            results['benchmarks'][name] = bench(repeat)
+        except Exception as e:
+            results['benchmarks'][name] = {'error': repr(e)}
+        if verbose:
+            print('{} done in {:.1f}s'.format(name, time.time() - t))
+    return results
+
+def compare(results, baseline):
+    ''' Prints the best time of every step of results against the same step of a baseline run '''
+    print('{:<16}{:<22}{:>12}{:>12}{:>9}'.format('benchmark', 'step', 'baseline', 'current', 'speedup'))
+    for name, steps in results['benchmarks'].items():
+        for step, stats in steps.items():
+            old = baseline['benchmarks'].get(name, {}).get(step)
+            if not isinstance(stats, dict) or not isinstance(old, dict) or 'best' not in stats or 'best' not in old:
+                continue
+            print('{:<16}{:<22}{:>11.4f}s{:>11.4f}s{:>8.2f}x'.format(name, step, old['best'], stats['best'], old['best']/stats['best']))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks the project on SampleFits/ and Data/my_data3.csv')
+    parser.add_argument('output', help='json file for the results')
+    parser.add_argument('--repeat', type=int, default=3, help='number of times each benchmark is run')
+    parser.add_argument('--only', default=None, help='comma-separated benchmarks to run, from ' + ', '.join(n for n, _ in BENCHMARKS))
+    parser.add_argument('--baseline', default=None, help='json results of an earlier run to compare with')
+    args = parser.parse_args()
+
+    results = run(args.only.split(',') if args.only else None, args.repeat)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
@@ -0,0 +1,84 @@
+''' Blackbody curves for plotting, regression diagnostics and synthetic training data. A few temperatures are
+evaluated exactly with the Planck formula. For large batches (TABLE_MIN temperatures or more) the normalised curves of
+the wavelength grid are tabulated once in float32 on a logarithmic temperature grid and cached, and curves at any
+temperature are interpolated linearly between neighbouring rows, so a batch costs two table lookups per pixel
+instead of an exp '''
+
+import numpy as np
+
+H = 6.63e-34
+C = 3e8
+K = 1.38e-23
+
+T_MIN = 2000
+T_MAX = 50000
+LOG_STEP = 0.01
+TABLE_MIN = 256
+MAX_TABLES = 2
+
+def planck(temps, wavelength):
+    ''' The blackbody energy density of each temperature at each wavelength (in Angstroms), shape (N, pixels) '''
+    lam = np.asarray(wavelength)*1e-10
+    temps = np.asarray(temps, dtype=float).reshape(-1, 1)
+    return (8*np.pi*H*C)/(lam**5*(np.exp(H*C/(lam*K*temps))-1))
+
+def normalised_planck(temps, wavelength):
+    ''' Unit-sum Planck curves (float32) of temperatures, shape (N, pixels), nans giving rows of nans '''
+    with np.errstate(invalid='ignore', over='ignore'):
+        curves = planck(temps, wavelength)
+        return (curves/np.sum(curves, axis=1, keepdims=True)).astype(np.float32)
+
+class PlanckTable():
+    ''' Unit-sum float32 Planck curves of one wavelength grid at temperatures from tmin to tmax in steps of log_step
+    in ln T. Interpolation errors are around 5e-5 of the peak of the curve; temperatures outside the table are
+    computed exactly and nans give rows of nans '''
+    def __init__(self, wavelength, tmin=T_MIN, tmax=T_MAX, log_step=LOG_STEP):
+        self.wavelength = np.asarray(wavelength, dtype=float)
+        self.log_step = log_step
+        self.log_temps = np.arange(np.log(tmin), np.log(tmax) + log_step, log_step)
+        self.curves = normalised_planck(np.exp(self.log_temps), self.wavelength)
+
+    def __call__(self, temps):
+        ''' Returns the unit-sum curves (float32) of an array (or scalar) of temperatures, shape (N, pixels) '''
+        temps = np.asarray(temps, dtype=float).reshape(-1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            pos = (np.log(temps) - self.log_temps[0])/self.log_step
+        inside = (pos >= 0) & (pos <= len(self.curves) - 1)
+        i = np.minimum(pos[inside].astype(int), len(self.curves) - 2)
+        frac = (pos[inside] - i).astype(np.float32)[:, None]
+        rows = self.curves[i]*(1 - frac)
+        rows += self.curves[i + 1]*frac
+        if inside.all():
+            return rows
+        out = np.full((len(temps), len(self.wavelength)), np.nan, dtype=np.float32)
+        out[inside] = rows
+        outside = ~inside & ~np.isnan(temps)
+        if outside.any():
+            out[outside] = normalised_planck(temps[outside], self.wavelength)
+        return out
+
+_tables = {}
+
+def planck_table(wavelength):
+    ''' The cached PlanckTable of a wavelength grid, building it on first use (keeping the MAX_TABLES most recent) '''
+    wavelength = np.asarray(wavelength, dtype=float)
+    key = hash(wavelength.tobytes())
+    if key not in _tables:
+        if len(_tables) >= MAX_TABLES:
+            del _tables[next(iter(_tables))]
+        _tables[key] = PlanckTable(wavelength)
+    else:
+        _tables[key] = _tables.pop(key)
+    return _tables[key]
+
+def blackbody(temps, wavelength, counts=1):
+    ''' Blackbody curves of temperatures (a scalar or array) on a wavelength grid, each scaled to sum to counts
+    (a scalar or one value per temperature), as float32 of shape (N, pixels). Batches smaller than TABLE_MIN are
+    evaluated exactly, without building a table '''
+    if np.size(temps) < TABLE_MIN:
+        curves = normalised_planck(temps, wavelength)
+    else:
+        curves = planck_table(wavelength)(temps)
+    if not np.isscalar(counts) or counts != 1:
+        curves *= np.asarray(counts, dtype=np.float32).reshape(-1, 1)
+    return curves
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+''' Converts a pipe-separated LAMOST catalogue (dr1.csv, dr1_stellar.csv) once into a directory of per-column
+numpy arrays with duplicate designations already dropped, plus a hash index on designation, so that scripts
+load only the columns they need in milliseconds instead of re-parsing the whole csv '''
+
+import os
+import sys
+import json
+import time
+import shutil
+
+import numpy as np
+import pandas as pd
+
+import instrument
+
+META_FILE = 'catalog.json'
+HASH_FILE = 'designation.hash.npy'
+ORDER_FILE = 'designation.order.npy'
+
+def is_catalog(path):
+    ''' Checks whether a path points to a catalogue store rather than a csv file '''
+    return isinstance(path, str) and os.path.isfile(os.path.join(path, META_FILE))
+
+def catalog_path(csv_file):
+    ''' The store that read_catalog keeps alongside a catalogue csv '''
+    return os.path.splitext(csv_file)[0] + '.catalog'
+
+def source_identity(csv_file):
+    ''' The size and modification time used to decide whether a store is out of date with its csv '''
+    st = os.stat(csv_file)
+    return [st.st_size, st.st_mtime_ns]
+
+def hash_designations(designations):
+    ''' 64 bit hashes of designations, stable between runs '''
+    return pd.util.hash_array(np.asarray(designations, dtype=object))
+
+def build_catalog(csv_file, store_dir, sep='|', verbose=True):
+    ''' Parses csv_file once, drops duplicate designations and writes each column to store_dir as a .npy array '''
+    t = time.time()
+    catalog = pd.read_csv(csv_file, sep=sep, low_memory=False)
+    catalog.drop_duplicates(subset = 'designation', inplace = True)
+    tmp_dir = store_dir + '.tmp'
+    if os.path.isdir(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    columns = []
+    for idx, col in enumerate(catalog.columns):
+        values = catalog[col].values
+        if values.dtype == object:
+            values = np.array(['' if v != v else str(v) for v in values], dtype=str)
+        np.save(os.path.join(tmp_dir, '{}.npy'.format(idx)), values)
+        columns.append(col)
+    hashes = hash_designations(catalog['designation'].values)
+    order = np.argsort(hashes, kind='mergesort')
+    np.save(os.path.join(tmp_dir, HASH_FILE), hashes[order])
+    np.save(os.path.join(tmp_dir, ORDER_FILE), order)
+    with open(os.path.join(tmp_dir, META_FILE), 'w') as f:
+        json.dump({'columns': columns, 'rows': len(catalog), 'source': source_identity(csv_file)}, f)
+    if os.path.isdir(store_dir):
+        shutil.rmtree(store_dir)
+    os.replace(tmp_dir, store_dir)
+    if verbose:
+        print('Stored {} catalogue rows in {:.1f}s'.format(len(catalog), time.time() - t))
+    return CatalogStore(store_dir)
+
+class CatalogStore():
+    ''' A catalogue written by build_catalog, read a column at a time through memory maps '''
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.columns = self.meta['columns']
+        self.hashes = np.load(os.path.join(store_dir, HASH_FILE), mmap_mode='r')
+        self.order = np.load(os.path.join(store_dir, ORDER_FILE), mmap_mode='r')
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def column(self, name):
+        ''' The memory-mapped array of one column (missing strings are stored as empty strings) '''
+        return np.load(os.path.join(self.store_dir, '{}.npy'.format(self.columns.index(name))), mmap_mode='r')
+
+    def load(self, columns=None, rows=None):
+        ''' Returns the given columns (default all) of the given rows (default all) as a DataFrame '''
+        columns = self.columns if columns is None else columns
+        data = {}
+        for col in columns:
+            values = self.column(col)
+            values = values[:] if rows is None else values[rows]
+            if values.dtype.kind == 'U':
+                values = values.astype(object)
+                values[values == ''] = np.nan
+            data[col] = np.array(values)
+        return pd.DataFrame(data, columns=columns)
+
+    def lookup(self, designations):
+        ''' Returns the row of each designation in the catalogue, or -1 where it is not present '''
+        if len(self.hashes) == 0 or len(designations) == 0:
+            return np.full(len(designations), -1, dtype=np.int64)
+        hashes = hash_designations(designations)
+        pos = np.searchsorted(self.hashes, hashes)
+        pos[pos == len(self.hashes)] = 0
+        rows = np.where(self.hashes[pos] == hashes, self.order[pos], -1)
+        found = rows >= 0
+        rows[found] = np.where(self.column('designation')[rows[found]] == np.asarray(designations, dtype=str)[found], rows[found], -1)
+        return rows
+
+def open_catalog(path, sep='|'):
+    ''' Returns the CatalogStore of a store, or of a csv file, building (or rebuilding, if the csv has changed)
+    the csv's store on first use '''
+    if is_catalog(path):
+        return CatalogStore(path)
+    store_dir = catalog_path(path)
+    if not is_catalog(store_dir) or CatalogStore(store_dir).meta['source'] != source_identity(path):
+        return build_catalog(path, store_dir, sep)
+    return CatalogStore(store_dir)
+
+def read_catalog(path, columns=None, sep='|'):
+    ''' Loads columns of a catalogue from its store, falling back to parsing the csv if the store cannot be written '''
+    try:
+        store = open_catalog(path, sep)
+    except OSError:
+        usecols = None if columns is None else ['designation'] + [c for c in columns if c != 'designation']
+        catalog = pd.read_csv(path, sep=sep, usecols=usecols)
+        catalog.drop_duplicates(subset = 'designation', inplace = True)
+        return catalog if columns is None else catalog[columns].reset_index(drop=True)
+    return store.load(columns)
+
+def iter_chunks(tables, chunksize=100000):
+    ''' Yields DataFrames of at most chunksize rows from a csv file, a list of csv files or DataFrames '''
+    if isinstance(tables, (str, pd.DataFrame)):
+        tables = [tables]
+    for table in tables:
+        if isinstance(table, pd.DataFrame):
+            for start in range(0, len(table), chunksize):
+                yield table.iloc[start:start+chunksize]
+        else:
+            for chunk in pd.read_csv(table, sep=',', chunksize=chunksize):
+                yield chunk
+
+class CatalogJoin():
+    ''' Streams feature tables against the designation index of a catalogue, producing the rows of
+    catalog.merge(features, on='designation', how='inner') a chunk at a time and recording the designations
+    that are not in the catalogue '''
+    def __init__(self, catalog, columns=None):
+        self.store = open_catalog(catalog)
+        columns = self.store.columns if columns is None else columns
+        self.columns = ['designation'] + [c for c in columns if c != 'designation']
+        self.unmatched = []
+        self.matched = 0
+
+    def chunks(self, features, chunksize=100000):
+        ''' Yields the joined chunks of features (see iter_chunks), holding one chunk of each table at a time '''
+        for chunk in iter_chunks(features, chunksize):
+            desig = chunk['designation'].values
+            rows = self.store.lookup(desig)
+            found = rows >= 0
+            self.unmatched.extend(desig[~found])
+            cat = self.store.load(self.columns[1:], rows[found])
+            feats = chunk[found].drop(columns='designation').reset_index(drop=True)
+            both = set(cat.columns) & set(feats.columns)
+            cat.columns = [c + '_x' if c in both else c for c in cat.columns]
+            feats.columns = [c + '_y' if c in both else c for c in feats.columns]
+            cat.insert(0, 'designation', desig[found])
+            self.matched += found.sum()
+            yield pd.concat([cat, feats], axis=1)
+
+    def merge(self, features, chunksize=100000, sort=None, ascending=True, limit=None):
+        ''' Returns the whole join as a DataFrame or, given a limit, only its first limit rows ordered by sort,
+        keeping no more than limit + chunksize joined rows in memory '''
+        with instrument.span('join'):
+            kept = []
+            for joined in self.chunks(features, chunksize):
+                kept.append(joined)
+                if limit:
+                    kept = [pd.concat(kept, ignore_index=True).sort_values(sort, ascending=ascending)[:limit]]
+            instrument.count('rows_joined', self.matched)
+            instrument.count('rows_unmatched', len(self.unmatched))
+            if not kept:
+                return pd.DataFrame(columns=self.columns)
+            return pd.concat(kept, ignore_index=True)
+
+    def report(self, show=5):
+        ''' Prints the number of joined rows and the designations that were not found in the catalogue '''
+        print('Joined {} rows, {} designations not in the catalogue'.format(self.matched, len(self.unmatched)))
+        if self.unmatched:
+            print('Unmatched : ', ', '.join(str(d) for d in self.unmatched[:show]) + (' ...' if len(self.unmatched) > show else ''))
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage : ./catalog_store.py catalog.csv store_dir")
+        sys.exit(1)
+    build_catalog(sys.argv[1], sys.argv[2])
@@ -0,0 +1,28 @@
+''' Evaluates a classifier over a test set a chunk at a time, accumulating the accuracy and confusion matrix rather
+than running the whole test set through the network at once, with an optional fixed random subsample for the
+periodic checks made during training '''
+
+import numpy as np
+
+class ChunkedEvaluator():
+    ''' Holds a test set (flux x and one-hot labels y) and evaluates predict functions over it in chunks '''
+    def __init__(self, x, y, classes, chunk=1000, subsample=None, seed=None):
+        self.x = x
+        self.truth = np.argmax(y, axis=1)
+        self.classes = classes
+        self.chunk = chunk
+        self.subsample = np.arange(len(x))
+        if subsample is not None and subsample < len(x):
+            self.subsample = np.sort(np.random.RandomState(seed).choice(len(x), subsample, replace=False))
+
+    def evaluate(self, predict, full=False):
+        ''' Runs predict (flux chunk -> predicted class indices) over the subsample, or the whole test set if full,
+        and returns the accuracy, the confusion matrix (indexed [predicted, true], as tf.confusion_matrix is called
+        in the training scripts) and the predictions '''
+        rows = np.arange(len(self.x)) if full else self.subsample
+        pred = np.empty(len(rows), dtype=int)
+        for start in range(0, len(rows), self.chunk):
+            pred[start:start+self.chunk] = predict(self.x[rows[start:start+self.chunk]])
+        truth = self.truth[rows]
+        conf = np.bincount(pred*self.classes + truth, minlength=self.classes**2).reshape(self.classes, self.classes)
+        return np.trace(conf)/max(len(rows), 1), conf, pred
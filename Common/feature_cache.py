@@ -0,0 +1,92 @@
+''' A persistent cache of the read_fits.Spectrum features of each fits file, so that reruns only process files that are
+new or have changed and only compute feature columns whose definition is new '''
+
+import os
+import hashlib
+import sqlite3
+
+import pandas as pd
+
+META = ['FILENAME', 'designation', 'CLASS']
+SMOOTHING = {'d1': 'boxcar 10', 'd2': 'boxcar 100', 'd3': 'boxcar 10 - boxcar 100'}
+
+def feature_column(name, definition):
+    ''' Names the cache column of a feature after its name and a hash of its definition (e.g. its wavelength window) '''
+    return '{}_{}'.format(name, hashlib.md5(repr((name, definition)).encode()).hexdigest()[:8])
+
+def identity(path):
+    ''' The size and modification time used to decide whether a file has changed since it was cached '''
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+class FeatureCache():
+    ''' Feature values of each file keyed by path, size and mtime, with one column per feature definition
+    and a quarantine table of files that failed to process '''
+    def __init__(self, db, fdict):
+        self.db = db
+        self.features = list(fdict) + list(SMOOTHING)
+        self.columns = {feat: feature_column(feat, lam) for feat, lam in fdict.items()}
+        self.columns.update({d: feature_column(d, definition) for d, definition in SMOOTHING.items()})
+        self.conn = sqlite3.connect(db)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS features (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, '
+                          'FILENAME TEXT, designation TEXT, CLASS TEXT)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS quarantine (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER)')
+        existing = {row[1] for row in self.conn.execute('PRAGMA table_info(features)')}
+        for col in self.columns.values():
+            if col not in existing:
+                self.conn.execute('ALTER TABLE features ADD COLUMN "{}" REAL'.format(col))
+        self.conn.commit()
+
+    def plan(self, files):
+        ''' Returns {path: [features to compute]} for the files that are new, changed or missing a feature column,
+        skipping files quarantined since they last changed '''
+        cols = ', '.join('"{}"'.format(self.columns[f]) for f in self.features)
+        known = {row[0]: row[1:] for row in self.conn.execute('SELECT path, size, mtime, {} FROM features'.format(cols))}
+        quarantined = {row[0]: tuple(row[1:]) for row in self.conn.execute('SELECT path, size, mtime FROM quarantine')}
+        todo = {}
+        for f in files:
+            path = os.path.abspath(f)
+            ident = identity(path)
+            if quarantined.get(path) == ident:
+                continue
+            row = known.get(path)
+            if row is None or tuple(row[:2]) != ident:
+                todo[f] = list(self.features)
+                continue
+            missing = [feat for feat, value in zip(self.features, row[2:]) if value is None]
+            if missing:
+                todo[f] = missing
+        return todo
+
+    def store(self, f, row):
+        ''' Saves the features in row (a dictionary including the META cards) against the current identity of file f '''
+        path = os.path.abspath(f)
+        ident = identity(path)
+        cached = self.conn.execute('SELECT size, mtime FROM features WHERE path = ?', (path,)).fetchone()
+        if cached is None or tuple(cached) != ident:
+            self.conn.execute('INSERT OR REPLACE INTO features (path, size, mtime) VALUES (?, ?, ?)', (path,) + ident)
+        keys = [k for k in row if k in self.columns or k in META]
+        sets = ', '.join('"{}" = ?'.format(self.columns.get(k, k)) for k in keys)
+        self.conn.execute('UPDATE features SET {} WHERE path = ?'.format(sets), [row[k] for k in keys] + [path])
+        self.conn.execute('DELETE FROM quarantine WHERE path = ?', (path,))
+
+    def quarantine(self, f):
+        ''' Records that file f failed, so it is not retried until it changes '''
+        path = os.path.abspath(f)
+        self.conn.execute('INSERT OR REPLACE INTO quarantine VALUES (?, ?, ?)', (path,) + identity(path))
+        self.conn.execute('DELETE FROM features WHERE path = ?', (path,))
+
+    def quarantined(self):
+        ''' Paths of the files currently in quarantine '''
+        return [row[0] for row in self.conn.execute('SELECT path FROM quarantine')]
+
+    def commit(self):
+        ''' Writes pending changes to the database '''
+        self.conn.commit()
+
+    def load(self, files):
+        ''' Returns the cached features of files as a DataFrame laid out like the output of read_fits.Spectrum '''
+        cols = ', '.join('"{}" AS "{}"'.format(self.columns[f], f) for f in self.features)
+        df = pd.read_sql_query('SELECT path, {}, {} FROM features'.format(cols, ', '.join(META)), self.conn)
+        df = df[df['path'].isin([os.path.abspath(f) for f in files])]
+        return df[self.features + META].reset_index(drop=True)
@@ -0,0 +1,86 @@
+''' A csv writer for feature rows that buffers them in preallocated arrays and appends them to disk a chunk at a time,
+replacing the one-row DataFrame and pd.concat per file pattern. A checkpoint written atomically after each chunk lets
+an interrupted run resume, losing at most the rows of one chunk '''
+
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+class FeatureSink():
+    ''' Collects rows of the given columns (numeric unless listed in strings) and writes them to path in chunks '''
+    def __init__(self, path, columns, strings=(), chunk=1000, index=False):
+        self.path = path
+        self.checkpoint = path + '.checkpoint'
+        self.columns = list(columns)
+        self.strings = [c for c in self.columns if c in strings]
+        self.numbers = [c for c in self.columns if c not in strings]
+        self.chunk = chunk
+        self.index = index
+        self.num_buffer = np.empty((chunk, len(self.numbers)))
+        self.str_buffer = np.empty((chunk, len(self.strings)), dtype=object)
+        self.buffered = 0
+        self.rows = 0
+        self.inputs = 0
+
+    def resume(self):
+        ''' Starts the output file, or continues it from the last checkpoint, and returns the number of inputs
+        already accounted for (so the caller can skip them) '''
+        if os.path.isfile(self.checkpoint) and os.path.isfile(self.path):
+            with open(self.checkpoint) as f:
+                state = json.load(f)
+            with open(self.path, 'r+b') as f:
+                f.truncate(state['bytes'])
+            self.rows = state['rows']
+            self.inputs = state['inputs']
+        else:
+            header = ([''] if self.index else []) + self.columns
+            with open(self.path, 'w') as f:
+                f.write(','.join(header) + '\n')
+            self.rows = 0
+            self.inputs = 0
+            self._save_checkpoint()
+        return self.inputs
+
+    def append(self, row):
+        ''' Adds one row, given as a dictionary (or sequence in column order), for one input '''
+        if not isinstance(row, dict):
+            row = dict(zip(self.columns, row))
+        self.num_buffer[self.buffered] = [row[c] for c in self.numbers]
+        self.str_buffer[self.buffered] = [row[c] for c in self.strings]
+        self.buffered += 1
+        self.inputs += 1
+        if self.buffered == self.chunk:
+            self.flush()
+
+    def skip(self):
+        ''' Accounts for an input that produced no row (e.g. a file that failed to read) '''
+        self.inputs += 1
+
+    def flush(self):
+        ''' Appends the buffered rows to the output file and checkpoints the position reached '''
+        df = pd.DataFrame(self.num_buffer[:self.buffered], columns=self.numbers)
+        for i, c in enumerate(self.strings):
+            df[c] = self.str_buffer[:self.buffered, i]
+        df = df[self.columns]
+        if self.index:
+            df.index = np.arange(self.rows, self.rows + self.buffered)
+        with open(self.path, 'a') as f:
+            df.to_csv(f, header=False, index=self.index)
+            f.flush()
+            os.fsync(f.fileno())
+        self.rows += self.buffered
+        self.buffered = 0
+        self._save_checkpoint()
+
+    def close(self):
+        ''' Writes any remaining rows and removes the checkpoint, marking the output as complete '''
+        self.flush()
+        os.remove(self.checkpoint)
+
+    def _save_checkpoint(self):
+        state = {'rows': self.rows, 'inputs': self.inputs, 'bytes': os.path.getsize(self.path)}
+        with open(self.checkpoint + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(self.checkpoint + '.tmp', self.checkpoint)
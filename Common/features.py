@@ -0,0 +1,190 @@
+''' Batch versions of the spectral features computed by read_fits.Spectrum and makeCSV.py, working on an (N, pixels)
+flux matrix with a COEFF0 and COEFF1 per row rather than one spectrum at a time '''
+
+import numpy as np
+
+def wavelength_grid(coeff0, coeff1, pixels):
+    ''' Rebuilds the log-linear wavelength grid of a spectrum from its COEFF0 and COEFF1 cards '''
+    return 10**(coeff0 + coeff1*np.arange(pixels))
+
+def grid_groups(coeff0, coeff1, samples):
+    ''' Groups rows sharing a wavelength grid, returning the distinct (COEFF0, COEFF1) pairs and the group of each row '''
+    coeffs = np.column_stack((np.broadcast_to(np.ravel(coeff0), samples), np.broadcast_to(np.ravel(coeff1), samples)))
+    grids, group = np.unique(coeffs, axis=0, return_inverse=True)
+    return grids, group.ravel()
+
+def process_flux(flux, coeff0, coeff1):
+    ''' Sets negative flux and the echelle overlap region at ~5580 A to nan, as in Spectrum.process_fits_file '''
+    flux = np.array(flux, dtype=np.float64, ndmin=2)
+    flux[flux < 0] = np.nan
+    grids, group = grid_groups(coeff0, coeff1, len(flux))
+    for g, (init, disp) in enumerate(grids):
+        wavelength = wavelength_grid(init, disp, flux.shape[1])
+        overlap = (wavelength > 5570) & (wavelength < 5590)
+        flux[np.ix_(group == g, overlap)] = np.nan
+    return flux
+
+def band_windows(wavelength, bands, inclusive=False):
+    ''' Finds the pixel window [lower, upper) of each band, excluding the band edges unless inclusive is set '''
+    bounds = np.array(list(bands), dtype=np.float64).reshape(-1, 2)
+    if inclusive:
+        lower = np.searchsorted(wavelength, bounds[:, 0], side='left')
+        upper = np.searchsorted(wavelength, bounds[:, 1], side='right')
+    else:
+        lower = np.searchsorted(wavelength, bounds[:, 0], side='right')
+        upper = np.searchsorted(wavelength, bounds[:, 1], side='left')
+    return lower, np.maximum(upper, lower)
+
+def row_windows(samples, pixels, coeff0, coeff1, bands, inclusive=False):
+    ''' Computes the band windows once per distinct wavelength grid and returns (samples, bands) arrays of them '''
+    grids, group = grid_groups(coeff0, coeff1, samples)
+    lower = np.zeros((len(grids), len(bands)), dtype=int)
+    upper = np.zeros((len(grids), len(bands)), dtype=int)
+    for g, (init, disp) in enumerate(grids):
+        lower[g], upper[g] = band_windows(wavelength_grid(init, disp, pixels), bands, inclusive)
+    return lower[group], upper[group]
+
+def cumulative(flux):
+    ''' Running sums of the non-nan flux and of the number of non-nan pixels, with a leading zero column '''
+    good = ~np.isnan(flux)
+    csum = np.zeros((flux.shape[0], flux.shape[1] + 1))
+    count = np.zeros((flux.shape[0], flux.shape[1] + 1))
+    np.cumsum(np.where(good, flux, 0), axis=1, out=csum[:, 1:])
+    np.cumsum(good, axis=1, out=count[:, 1:])
+    return csum, count
+
+def window_nanmean(csum, count, lower, upper):
+    ''' Nan-ignoring mean of the flux between lower and upper for every row and window '''
+    total = np.take_along_axis(csum, upper, axis=1) - np.take_along_axis(csum, lower, axis=1)
+    n = np.take_along_axis(count, upper, axis=1) - np.take_along_axis(count, lower, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return total/n
+
+def colour_features(flux, coeff0, coeff1, bands, inclusive=False, sums=None):
+    ''' Returns the -2.5*log10(nanmean) magnitude of every band for every row of flux, with nan and inf set to 0 '''
+    flux = np.array(flux, dtype=np.float64, ndmin=2)
+    lower, upper = row_windows(flux.shape[0], flux.shape[1], coeff0, coeff1, bands, inclusive)
+    csum, count = cumulative(flux) if sums is None else sums
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mags = -2.5*np.log10(window_nanmean(csum, count, lower, upper))
+    mags[~np.isfinite(mags)] = 0
+    return mags
+
+def equivalent_width(flux, wavelength, lower, upper, flank=20):
+    ''' Equivalent width of one line window for every row of flux, using a straight-line continuum fitted by
+    least squares to the flank pixels either side of the window (nan flank pixels are masked out of the sums) '''
+    if upper - lower < 2:
+        return np.full(len(flux), np.nan)
+    width = wavelength[upper-1] - wavelength[lower]
+    mid = (wavelength[upper-1] + wavelength[lower])/2
+    idx = np.r_[max(lower-flank, 0):lower, upper-1:min(upper-1+flank, len(wavelength))]
+    x = wavelength[idx] - mid
+    y = flux[:, idx]
+    good = ~np.isnan(y)
+    y = np.where(good, y, 0)
+    n = good.sum(axis=1)
+    sx = good @ x
+    sxx = good @ x**2
+    sy = y.sum(axis=1)
+    sxy = y @ x
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = (n*sxy - sx*sy)/(n*sxx - sx**2)
+        continuum = (sy - slope*sx)/n*width
+        line = np.sum(np.diff(wavelength[lower:upper])*(flux[:, lower+1:upper] + flux[:, lower:upper-1])/2, axis=1)
+        return (continuum - line)/continuum*width
+
+def line_features(flux, coeff0, coeff1, bands, inclusive=False, flank=20):
+    ''' Returns the equivalent width of every line window for every row of flux, with nan and inf set to 0 '''
+    flux = np.array(flux, dtype=np.float64, ndmin=2)
+    widths = np.zeros((len(flux), len(bands)))
+    grids, group = grid_groups(coeff0, coeff1, len(flux))
+    for g, (init, disp) in enumerate(grids):
+        rows = group == g
+        sub = flux if len(grids) == 1 else flux[rows]
+        wavelength = wavelength_grid(init, disp, flux.shape[1])
+        lower, upper = band_windows(wavelength, bands, inclusive)
+        for b in range(len(bands)):
+            widths[rows, b] = equivalent_width(sub, wavelength, lower[b], upper[b], flank)
+    widths[~np.isfinite(widths)] = 0
+    return widths
+
+def boxcar_smooth(flux, widths):
+    ''' Nan-ignoring moving averages of every row of flux for each width, matching astropy's
+    convolve(flux, Box1DKernel(width)) with zero fill beyond the ends, from one set of running sums '''
+    flux = np.array(flux, dtype=np.float64, ndmin=2)
+    pixels = flux.shape[1]
+    pad = max(widths)//2 + 1
+    csum, count = cumulative(np.pad(flux, ((0, 0), (pad, pad))))
+    def window(a, sums):
+        return sums[:, pad+a+1:pad+a+1+pixels] - sums[:, pad-a:pad-a+pixels]
+    smooths = []
+    for width in widths:
+        half = width//2
+        if width % 2:
+            total, n = window(half, csum), window(half, count)
+        else:
+            # an even Box1DKernel spans width+1 pixels with half weight on the two end pixels
+            total = window(half, csum) + window(half-1, csum)
+            n = window(half, count) + window(half-1, count)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            smooths.append(total/n)
+    return smooths
+
+def smoothing_features(flux, widths=(10, 100), buff=100, raw=None, positive=False):
+    ''' Mean absolute differences between flux and each boxcar smoothing of it, then between each pair of smoothings,
+    relative to the mean flux and ignoring buff pixels at each end. With the default widths these are d1, d2 and d3.
+    raw is the flux to smooth if it differs from flux, and positive sets negative smoothed flux to nan as in makeCSV.py '''
+    flux = np.array(flux, dtype=np.float64, ndmin=2)
+    smooths = boxcar_smooth(flux if raw is None else raw, widths)
+    cut = slice(buff, flux.shape[1] - buff)
+    flux_cut = flux[:, cut]
+    smooths = [s[:, cut] for s in smooths]
+    if positive:
+        for s in smooths:
+            s[s < 0] = np.nan
+    diffs = [flux_cut - s for s in smooths]
+    diffs += [smooths[i] - smooths[j] for i in range(len(widths)) for j in range(i+1, len(widths))]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        total = nanmean(flux)
+        return np.column_stack([nanmean(np.abs(d)) for d in diffs])/total[:, None]
+
+def nanmean(flux):
+    ''' Row-wise mean ignoring nans, returning nan (without a warning) for rows with no valid pixels '''
+    good = ~np.isnan(flux)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(good, flux, 0).sum(axis=1)/good.sum(axis=1)
+
+def spectrum_features(flux, coeff0, coeff1, fdict, inclusive=False):
+    ''' Computes the read_fits.Spectrum features of every row of flux: the fdict colour and line features
+    (0 for any other key) followed by d1, d2 and d3 '''
+    raw = np.array(flux, dtype=np.float64, ndmin=2)
+    flux = process_flux(raw, coeff0, coeff1)
+    smoothing = smoothing_features(flux, (10, 100), buff=100, raw=raw)
+    csum, count = cumulative(flux)
+    feats = np.zeros((len(flux), len(fdict)))
+    keys = list(fdict)
+    colours = [i for i, feat in enumerate(keys) if feat[0]=='c']
+    lines = [i for i, feat in enumerate(keys) if feat[0]=='l']
+    if colours:
+        feats[:, colours] = colour_features(flux, coeff0, coeff1, [fdict[keys[i]] for i in colours], inclusive, (csum, count))
+    if lines:
+        feats[:, lines] = line_features(flux, coeff0, coeff1, [fdict[keys[i]] for i in lines], inclusive)
+    return np.column_stack((feats, smoothing))
+
+def pair_names(names, op='-'):
+    ''' Names of the pairwise features of names (e.g. cB, cV -> B-V), in the order of a double loop over i < j,
+    with the column indices of each pair '''
+    i, j = np.triu_indices(len(names), 1)
+    return [names[a][1:] + op + names[b][1:] for a, b in zip(i, j)], i, j
+
+def pairwise_features(values, names, op='-', subset=None):
+    ''' All differences (op '-') or ratios (op '/') between pairs of columns of values, computed in one broadcast,
+    with their names. Given a subset of names, only those pairs are computed '''
+    pnames, i, j = pair_names(names, op)
+    if subset is not None:
+        keep = np.array([n in subset for n in pnames], dtype=bool)
+        pnames, i, j = [n for n, k in zip(pnames, keep) if k], i[keep], j[keep]
+    values = np.asarray(values, dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        pairs = values[:, i] - values[:, j] if op == '-' else values[:, i]/values[:, j]
+    return pairs, pnames
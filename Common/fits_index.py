@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+''' Builds a SQLite catalogue of the headers of a directory of LAMOST fits files, reading only the primary
+header blocks, so that scripts can filter on class or SNR before opening any spectra '''
+
+import os
+import sys
+import glob
+import time
+import sqlite3
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+from lamost_fits import SNR_BANDS, USED_CARDS, header_row, read_header_cards
+
+INDEX_COLUMNS = [('path', 'TEXT PRIMARY KEY'), ('filename', 'TEXT'), ('designation', 'TEXT'),
+                 ('CLASS', 'TEXT'), ('SUBCLASS', 'TEXT'),
+                 ('SNRU', 'REAL'), ('SNRG', 'REAL'), ('SNRR', 'REAL'), ('SNRI', 'REAL'), ('SNRZ', 'REAL'),
+                 ('SNR', 'REAL'), ('LMJD', 'INTEGER'), ('PLANID', 'TEXT'), ('SPID', 'INTEGER'),
+                 ('FIBERID', 'INTEGER'), ('RA', 'REAL'), ('DEC', 'REAL'), ('COEFF0', 'REAL'), ('COEFF1', 'REAL')]
+
+INDEXED = ['designation', 'CLASS', 'SUBCLASS', 'SNR']
+
+POSITION_CARDS = ['LMJD', 'PLANID', 'SPID', 'FIBERID', 'RA', 'DEC']
+INDEX_CARDS = USED_CARDS + POSITION_CARDS
+
+def is_index(path):
+    ''' Checks whether a path points to a header index rather than a glob of fits files '''
+    return isinstance(path, str) and path.endswith('.db') and os.path.isfile(path)
+
+def scan_header(path):
+    ''' Worker function returning the index row of one fits file, or None if its header cannot be read '''
+    try:
+        cards = read_header_cards(path, INDEX_CARDS)
+        row = header_row(cards)
+    except Exception:
+        return None
+    snr = [row['SNR' + b] for b in SNR_BANDS]
+    row['SNR'] = np.nanmax(snr) if not np.all(np.isnan(snr)) else np.nan
+    for key in POSITION_CARDS:
+        row[key] = cards.get(key)
+    row['path'] = os.path.abspath(path)
+    return tuple(row[c] for c, _ in INDEX_COLUMNS)
+
+def build_index(files, db, processes=None, chunksize=500, verbose=True):
+    ''' Scans the headers of files over a pool of worker processes and inserts them into the spectra table of db '''
+    t = time.time()
+    with sqlite3.connect(db) as conn:
+        conn.execute('CREATE TABLE IF NOT EXISTS spectra ({})'.format(', '.join(c + ' ' + d for c, d in INDEX_COLUMNS)))
+        insert = 'INSERT OR REPLACE INTO spectra VALUES ({})'.format(', '.join('?'*len(INDEX_COLUMNS)))
+        rows = []
+        failed = 0
+        with Pool(processes) as pool:
+            for idx, row in enumerate(pool.imap(scan_header, files, chunksize)):
+                if row is None:
+                    print('Failed for file : ', files[idx])
+                    failed += 1
+                    continue
+                rows.append(row)
+                if len(rows) == chunksize:
+                    conn.executemany(insert, rows)
+                    rows = []
+                if verbose and (idx+1) % (10*chunksize) == 0:
+                    print('{} / {} headers indexed, {:.1f}s'.format(idx+1, len(files), time.time() - t))
+        conn.executemany(insert, rows)
+        for col in INDEXED:
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_{0} ON spectra ({0})'.format(col))
+    if verbose:
+        print('Indexed {} headers in {:.1f}s, {} failed'.format(len(files) - failed, time.time() - t, failed))
+
+def query_index(db, where=None, params=(), columns=None):
+    ''' Returns the rows of the index matching an SQL where clause as a DataFrame '''
+    sql = 'SELECT {} FROM spectra'.format(', '.join(columns) if columns else '*')
+    if where:
+        sql += ' WHERE ' + where
+    with sqlite3.connect(db) as conn:
+        return pd.read_sql_query(sql, conn, params=params)
+
+def select_files(db, SNR=None, CLASS=None):
+    ''' Returns the paths of spectra with an SNR of at least SNR in any band and/or of a single class '''
+    where = []
+    params = []
+    if SNR is not None:
+        where.append('SNR >= ?')
+        params.append(SNR)
+    if CLASS is not None:
+        where.append('CLASS = ?')
+        params.append(CLASS)
+    return query_index(db, ' AND '.join(where), params, columns=['path'])['path'].tolist()
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage : ./fits_index.py 'fits_glob' index.db")
+        sys.exit(1)
+    build_index(sorted(glob.glob(sys.argv[1])), sys.argv[2])
@@ -0,0 +1,161 @@
+''' Run instrumentation: nested timing spans and named counters, written as a JSON trace when the run ends, so that
+the time of a long run can be attributed to its read, feature, join, fit, evaluate and plot stages. Repeated spans of
+the same name under the same parent are aggregated (calls, total, min and max seconds), so per-file spans stay small
+at survey scale.
+
+Instrumentation is off unless enable(path) is called or the LAMOST_TRACE environment variable names the trace file
+(which may contain {time} and {pid}); while off, span returns a shared do-nothing context manager and count returns
+immediately. Spans and counts made inside pool worker processes are not collected '''
+
+import os
+import sys
+import json
+import time
+import atexit
+import functools
+import threading
+
+ENV = 'LAMOST_TRACE'
+
+class _NullSpan():
+    ''' The span used while instrumentation is off '''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL = _NullSpan()
+
+class Node():
+    ''' The aggregate of every span of one name under the same parent '''
+    __slots__ = ('name', 'calls', 'total', 'min', 'max', 'children')
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.total = 0.
+        self.min = float('inf')
+        self.max = 0.
+        self.children = {}
+
+    def child(self, name):
+        node = self.children.get(name)
+        if node is None:
+            node = self.children.setdefault(name, Node(name))
+        return node
+
+    def add(self, seconds):
+        self.calls += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def as_dict(self):
+        out = {'name': self.name, 'calls': self.calls, 'total': self.total, 'min': self.min if self.calls else 0.,
+               'max': self.max}
+        if self.children:
+            out['children'] = [c.as_dict() for c in self.children.values()]
+        return out
+
+class _Span():
+    ''' Times one entry into a node, making it the parent of spans opened inside it on the same thread '''
+    __slots__ = ('node', 'stack', 'start')
+
+    def __init__(self, node, stack):
+        self.node = node
+        self.stack = stack
+
+    def __enter__(self):
+        self.stack.append(self.node)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.node.add(time.perf_counter() - self.start)
+        self.stack.pop()
+        return False
+
+_enabled = False
+_path = None
+_root = None
+_counters = {}
+_started = None
+_lock = threading.Lock()
+_local = threading.local()
+
+def enabled():
+    ''' Whether spans and counters are being recorded '''
+    return _enabled
+
+def enable(path=None):
+    ''' Starts recording, writing the trace to path (if given) when the run exits '''
+    global _enabled, _path, _root, _counters, _started
+    if path is not None:
+        _path = path.format(time=time.strftime('%Y%m%d-%H%M%S'), pid=os.getpid())
+    _root = Node('run')
+    _counters = {}
+    _started = time.time()
+    _local.__dict__.clear()
+    _enabled = True
+
+def disable():
+    ''' Stops recording (the trace so far is kept until the next enable) '''
+    global _enabled
+    _enabled = False
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = [_root]
+    return stack
+
+def span(name):
+    ''' A context manager timing the enclosed block as a child of the innermost open span '''
+    if not _enabled:
+        return _NULL
+    stack = _stack()
+    return _Span(stack[-1].child(name), stack)
+
+def count(name, n=1):
+    ''' Adds n to a named counter '''
+    if _enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + n
+
+def timed(name=None):
+    ''' Decorator timing every call of a function as a span (named after the function by default) '''
+    def decorate(fn):
+        label = name or fn.__qualname__
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with span(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def trace():
+    ''' The spans and counters recorded so far '''
+    if _root is None:
+        return {}
+    return {'command': sys.argv, 'pid': os.getpid(), 'start': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(_started)),
+            'elapsed': time.time() - _started, 'spans': [c.as_dict() for c in _root.children.values()],
+            'counters': dict(_counters)}
+
+def write(path=None):
+    ''' Writes the trace as JSON to path (by default the path given to enable) '''
+    path = path or _path
+    if path is None or _root is None:
+        return
+    with open(path, 'w') as f:
+        json.dump(trace(), f, indent=2)
+
+@atexit.register
+def _write_at_exit():
+    if _enabled:
+        write()
+
+if os.environ.get(ENV):
+    enable(os.environ[ENV])
@@ -0,0 +1,177 @@
+''' Helpers for reading the LAMOST spectrum fits files shared by the classifier and regressor scripts. LAMOST spectra
+have a fixed layout, a primary HDU of BITPIX = -32 holding rows of flux, inverse variance, subcontinuum, andmask and
+ormask, so they are read natively: only the header cards the project uses are parsed and only the requested rows
+are read, straight into a big-endian float32 array. Files that do not match the layout are read with astropy.
+
+A source is a path to a .fits or .fits.gz file, or an object with a read() method returning the (possibly gzipped)
+contents of one, such as the tar archive members of spectrum_sources '''
+
+import io
+import os
+import gzip
+
+import numpy as np
+from astropy.io import fits
+
+import instrument
+
+BLOCK = 2880
+CARD = 80
+GZIP_MAGIC = b'\x1f\x8b'
+
+FLUX, IVAR, SUBCONTINUUM, ANDMASK, ORMASK = range(5)
+
+STRUCTURE_CARDS = ['SIMPLE', 'BITPIX', 'NAXIS', 'NAXIS1', 'NAXIS2', 'BSCALE', 'BZERO']
+USED_CARDS = ['FILENAME', 'DESIG', 'CLASS', 'SUBCLASS', 'COEFF0', 'COEFF1', 'DATE',
+              'SNRU', 'SNRG', 'SNRR', 'SNRI', 'SNRZ', 'SN_U', 'SN_G', 'SN_R', 'SN_I', 'SN_Z']
+
+SNR_BANDS = ['U', 'G', 'R', 'I', 'Z']
+
+HEADER_COLUMNS = ['filename', 'designation', 'CLASS', 'SUBCLASS',
+                  'SNRU', 'SNRG', 'SNRR', 'SNRI', 'SNRZ', 'COEFF0', 'COEFF1']
+
+def get_snr(header, band):
+    ''' Returns the SNR of a band, allowing for both the SNRU (DR3) and SN_U (DR1) style keywords '''
+    if 'SNR' + band in header:
+        return header['SNR' + band]
+    return header.get('SN_' + band, np.nan)
+
+def header_row(header):
+    ''' Collects the header cards used by the project into a dictionary keyed by HEADER_COLUMNS '''
+    row = {'filename': header['FILENAME'],
+           'designation': header['DESIG'][7:],
+           'CLASS': header['CLASS'],
+           'SUBCLASS': header.get('SUBCLASS', ''),
+           'COEFF0': header['COEFF0'],
+           'COEFF1': header['COEFF1']}
+    for band in SNR_BANDS:
+        row['SNR' + band] = get_snr(header, band)
+    return row
+
+def mk_class(cls, subclass):
+    ''' Replaces the STAR class with the MK type taken from the first letter of the subclass '''
+    if cls == 'STAR' and isinstance(subclass, str) and subclass:
+        return subclass[0]
+    return cls
+
+def read_spectrum(source):
+    ''' Reads the flux row and the header cards of a single LAMOST fits source '''
+    data, cards = read_rows(source, [FLUX])
+    return data[0], header_row(cards)
+
+def parse_card_value(text):
+    ''' Converts the value field of a header card into a python string, bool, int or float '''
+    text = text.strip()
+    if text.startswith("'"):
+        end = 1
+        while True:
+            end = text.find("'", end)
+            if end == -1:
+                end = len(text)
+                break
+            if text[end+1:end+2] != "'":
+                break
+            end += 2
+        return text[1:end].replace("''", "'").rstrip()
+    text = text.split('/')[0].strip()
+    if text == 'T' or text == 'F':
+        return text == 'T'
+    for cast in (int, float):
+        try:
+            return cast(text)
+        except ValueError:
+            pass
+    return text
+
+class NonStandardFits(IOError):
+    ''' Raised by the native reader for files that are not in the LAMOST primary HDU layout '''
+
+def parse_header(f, keys=None):
+    ''' Reads the primary header from an open fits file, returning the keyword/value cards (only those in keys,
+    if given) and the length of the header in bytes '''
+    keys = None if keys is None else set(k.encode('ascii') for k in keys)
+    cards = {}
+    size = 0
+    while True:
+        block = f.read(BLOCK)
+        if len(block) < BLOCK:
+            raise NonStandardFits('Truncated fits header in ' + getattr(f, 'name', 'file'))
+        size += BLOCK
+        for i in range(0, BLOCK, CARD):
+            key = block[i:i+8].rstrip()
+            if key == b'END':
+                return cards, size
+            if block[i+8:i+10] == b'= ' and (keys is None or key in keys):
+                cards[key.decode('ascii', 'replace')] = parse_card_value(block[i+10:i+CARD].decode('ascii', 'replace'))
+
+def read_header_cards(source, keys=None):
+    ''' Reads only the 2880 byte blocks of the primary header and returns its keyword/value cards (only those in keys,
+    if given) as a dictionary '''
+    with open_fits(source) as f:
+        return parse_header(f, keys)[0]
+
+def is_standard(cards):
+    ''' Whether header cards describe an unscaled 2D float32 primary HDU that the native reader can read '''
+    return (cards.get('SIMPLE') is True and cards.get('BITPIX') == -32 and cards.get('NAXIS') == 2
+            and cards.get('BSCALE', 1) == 1 and cards.get('BZERO', 0) == 0)
+
+def open_fits(source):
+    ''' Opens a fits source as a binary file, decompressing gzipped sources into memory in one call (zlib releases
+    the GIL, so sources can be decompressed in parallel threads) '''
+    if isinstance(source, str):
+        if not source.endswith('.gz'):
+            return open(source, 'rb')
+        with open(source, 'rb') as f:
+            data = f.read()
+    else:
+        data = source.read()
+    if data[:2] == GZIP_MAGIC:
+        data = gzip.decompress(data)
+    return io.BytesIO(data)
+
+def source_size(source):
+    ''' The size in bytes of a fits source as stored (compressed, for gzipped sources) '''
+    if isinstance(source, str):
+        return os.path.getsize(source)
+    return source.size
+
+def read_native(source, rows=(FLUX,), keys=USED_CARDS):
+    ''' Reads the header cards in keys and the given data rows of a LAMOST fits source without astropy, reading
+    only the span of the data block holding the rows. Returns native float32 rows and the cards '''
+    rows = np.atleast_1d(rows)
+    with open_fits(source) as f:
+        cards, offset = parse_header(f, list(keys) + STRUCTURE_CARDS)
+        if not is_standard(cards):
+            raise NonStandardFits('Not a LAMOST primary HDU : {}'.format(source))
+        width, height = cards['NAXIS1'], cards['NAXIS2']
+        if np.any(rows < 0) or np.any(rows >= height):
+            raise IndexError('Rows {} out of range for {} rows in {}'.format(rows, height, source))
+        lo, hi = rows.min(), rows.max() + 1
+        f.seek(offset + 4*width*lo)
+        buf = f.read(4*width*(hi - lo))
+    if len(buf) < 4*width*(hi - lo):
+        raise NonStandardFits('Truncated data in {}'.format(source))
+    data = np.frombuffer(buf, dtype='>f4').reshape(hi - lo, width)
+    return data[rows - lo].astype(np.float32), {k: cards[k] for k in cards if k not in STRUCTURE_CARDS or k in keys}
+
+def map_rows(path):
+    ''' Memory-maps the whole (big-endian) data block of a standard LAMOST fits file, with its header cards '''
+    with open(path, 'rb') as f:
+        cards, offset = parse_header(f)
+    if not is_standard(cards):
+        raise NonStandardFits('Not a LAMOST primary HDU : ' + path)
+    return np.memmap(path, dtype='>f4', mode='r', offset=offset, shape=(cards['NAXIS2'], cards['NAXIS1'])), cards
+
+def read_rows(source, rows=(FLUX,), keys=USED_CARDS):
+    ''' Reads the given rows (float32, shape (len(rows), pixels)) and header cards of a LAMOST fits source natively,
+    falling back to astropy for files in any other layout '''
+    try:
+        data, cards = read_native(source, rows, keys)
+    except NonStandardFits:
+        with open_fits(source) as f, fits.open(f) as hdulist:
+            data = np.array(hdulist[0].data[np.atleast_1d(rows)], dtype=np.float32)
+            cards = {k: hdulist[0].header[k] for k in keys if k in hdulist[0].header}
+    if instrument.enabled():
+        instrument.count('files_read')
+        instrument.count('bytes_read', source_size(source))
+    return data, cards
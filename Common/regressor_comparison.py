@@ -0,0 +1,96 @@
+''' Runs the regressor comparisons concurrently: each (regressor, target) fit runs in its own forked worker process,
+which shares the parent's training arrays read-only rather than copying them, up to a number of workers at once. A
+fit that overruns its time budget is killed, so a run is no longer gated on the slowest model, and the fit time,
+predict time, peak memory and MAD of every model and target are collected into one table '''
+
+import os
+import time
+import resource
+from multiprocessing import get_context
+from multiprocessing.connection import wait
+
+import numpy as np
+import pandas as pd
+
+from astropy.stats import mad_std
+from sklearn.base import clone
+
+def _fit_predict(regressor, X_train, y_train, X_test, conn):
+    ''' Worker: fits and applies one regressor, sending back its timings, memory growth and predictions '''
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        t = time.time()
+        regressor.fit(X_train, y_train)
+        fit_time = time.time() - t
+        t = time.time()
+        pred = np.asarray(regressor.predict(X_test), dtype=float).reshape(-1)
+        predict_time = time.time() - t
+        peak = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base)/1024
+        conn.send({'status': 'ok', 'fit_time': fit_time, 'predict_time': predict_time, 'peak_mb': peak, 'pred': pred})
+    except Exception as e:
+        conn.send({'status': 'failed: ' + repr(e)})
+    conn.close()
+
+def _budget(budget, name):
+    ''' The time budget of one regressor from a number of seconds, a dictionary of them by name, or None '''
+    return budget.get(name) if isinstance(budget, dict) else budget
+
+def compare_regressors(regressors, X_train, Y_train, X_test, Y_test, targets, budget=None, processes=None, verbose=True):
+    ''' Fits a clone of every regressor (a dictionary by name) to each target column of Y_train and predicts X_test,
+    running up to processes fits at once and killing any that exceed budget seconds. Returns a DataFrame with a row
+    per model and target (status, fit_time, predict_time, peak_mb and the MAD of the test errors) and a dictionary
+    of the test predictions by (name, target) '''
+    ctx = get_context('fork')
+    processes = processes or os.cpu_count()
+    X_train = np.asarray(X_train, dtype=float)
+    X_test = np.asarray(X_test, dtype=float)
+    Y_train = np.asarray(Y_train, dtype=float).reshape(len(X_train), -1)
+    Y_test = np.asarray(Y_test, dtype=float).reshape(len(X_test), -1)
+
+    queue = [(name, t) for t in range(len(targets)) for name in regressors]
+    running = {}
+    rows = []
+    predictions = {}
+    while queue or running:
+        while queue and len(running) < processes:
+            name, t = queue.pop(0)
+            recv, send = ctx.Pipe(False)
+            process = ctx.Process(target=_fit_predict, args=(clone(regressors[name]), X_train, Y_train[:, t], X_test, send), daemon=True)
+            process.start()
+            send.close()
+            running[recv] = (name, t, process, time.time())
+
+        wait(list(running), timeout=0.1)
+        for recv, (name, t, process, start) in list(running.items()):
+            limit = _budget(budget, name)
+            if recv.poll():
+                try:
+                    result = recv.recv()
+                except EOFError:
+                    result = {'status': 'crashed'}
+            elif limit is not None and time.time() - start > limit:
+                process.terminate()
+                result = {'status': 'timed out after {:g}s'.format(limit)}
+            elif not process.is_alive():
+                result = {'status': 'crashed'}
+            else:
+                continue
+            process.join()
+            recv.close()
+            del running[recv]
+
+            pred = result.pop('pred', None)
+            row = {'model': name, 'target': targets[t], 'status': result['status'], 'fit_time': np.nan,
+                   'predict_time': np.nan, 'peak_mb': np.nan, 'mad': np.nan}
+            row.update(result)
+            if pred is not None:
+                predictions[(name, targets[t])] = pred
+                row['mad'] = mad_std(pred - Y_test[:, t])
+            rows.append(row)
+            if verbose:
+                print('{model} ({target}) : {status}, fit {fit_time:.2f}s, predict {predict_time:.2f}s, '
+                      '{peak_mb:.0f}MB, MAD {mad:.3f}'.format(**row))
+
+    names = list(regressors)
+    rows.sort(key=lambda row: (list(targets).index(row['target']), names.index(row['model'])))
+    return pd.DataFrame(rows, columns=['model', 'target', 'status', 'fit_time', 'predict_time', 'peak_mb', 'mad']), predictions
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+''' A stellar-parameter model bundled with everything needed to apply it to new feature tables: the fitted Imputer,
+the raw feature list and the colours and lines paired from it, the fitted StandardScaler and one fitted regressor per
+parameter (or one multi-output forest for several). predict_features streams a feature table of any size through it
+and writes the predictions incrementally '''
+
+import sys
+import time
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from sklearn.ensemble import RandomForestRegressor
+
+from features import pairwise_features
+from catalog_store import iter_chunks
+from feature_sink import FeatureSink
+import instrument
+
+ID_COLUMNS = ['designation', 'filename', 'FILENAME']
+
+class MultiTargetForest():
+    ''' One random forest predicting several parameters at once, sharing the preprocessing and tree building between
+    them. The targets are standardised for fitting so that each counts equally in the split criterion '''
+    def __init__(self, targets, **params):
+        self.targets = list(targets)
+        self.forest = RandomForestRegressor(**params)
+
+    @property
+    def n_jobs(self):
+        return self.forest.n_jobs
+
+    @n_jobs.setter
+    def n_jobs(self, n_jobs):
+        self.forest.n_jobs = n_jobs
+
+    def fit(self, X, Y):
+        Y = np.asarray(Y, dtype=float).reshape(len(X), -1)
+        self.mean = Y.mean(axis=0)
+        self.scale = Y.std(axis=0)
+        self.scale[self.scale == 0] = 1
+        self.forest.fit(X, (Y - self.mean)/self.scale)
+        return self
+
+    def predict(self, X):
+        ''' Returns the predictions of every target, shape (N, targets) '''
+        return self.forest.predict(X).reshape(len(X), -1)*self.scale + self.mean
+
+    def target_importances(self, X, Y, seed=None):
+        ''' The permutation importance of each feature for each target: the increase in the mean squared error of
+        each target when the feature is shuffled, as a fraction of the total over features, shape (features, targets) '''
+        X = np.array(X, dtype=float)
+        Y = np.asarray(Y, dtype=float).reshape(len(X), -1)
+        rng = np.random.RandomState(seed)
+        base = np.mean((self.predict(X) - Y)**2, axis=0)
+        increase = np.empty((X.shape[1], Y.shape[1]))
+        for f in range(X.shape[1]):
+            column = X[:, f].copy()
+            X[:, f] = rng.permutation(column)
+            increase[f] = np.mean((self.predict(X) - Y)**2, axis=0) - base
+            X[:, f] = column
+        increase = np.maximum(increase, 0)
+        return increase/np.maximum(increase.sum(axis=0), 1e-300)
+
+class RegressorBundle():
+    ''' The preprocessing and regressors of model_RF.py / Temperature_Regressor: raw features imputed, extended with
+    every colour difference and line ratio, then scaled. models maps each parameter to its regressor, or a tuple of
+    parameters to a MultiTargetForest predicting them all '''
+    def __init__(self, imputer, scaler, base, colours, lines, models=None):
+        self.imputer = imputer
+        self.scaler = scaler
+        self.base = list(base)
+        self.colours = list(colours)
+        self.lines = list(lines)
+        self.models = {} if models is None else dict(models)
+
+    @property
+    def parameters(self):
+        ''' The parameters predicted, in output column order '''
+        return [p for key in self.models for p in (key if isinstance(key, tuple) else [key])]
+
+    def transform(self, df):
+        ''' Returns the scaled feature matrix of the rows of df, which must hold the raw feature columns '''
+        raw = self.imputer.transform(df[self.base].values)
+        diffs = pairwise_features(raw[:, [self.base.index(c) for c in self.colours]], self.colours, '-')[0]
+        ratios = pairwise_features(raw[:, [self.base.index(l) for l in self.lines]], self.lines, '/')[0]
+        return self.scaler.transform(np.hstack((raw, diffs, ratios)))
+
+    def predict(self, df, n_jobs=None):
+        ''' Returns a DataFrame of the predictions of each parameter for the rows of df '''
+        X = self.transform(df)
+        preds = {}
+        for key, model in self.models.items():
+            if n_jobs is not None:
+                model.n_jobs = n_jobs
+            if isinstance(key, tuple):
+                preds.update(zip(key, model.predict(X).T))
+            else:
+                preds[key] = model.predict(X)
+        return pd.DataFrame(preds, columns=self.parameters)
+
+    def save(self, path):
+        ''' Pickles the bundle to path '''
+        with open(path, 'wb') as f:
+            pickle.dump(self, f)
+
+def load_bundle(path):
+    ''' Loads a bundle saved by RegressorBundle.save '''
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+def predict_features(bundle, features, output, chunksize=100000, n_jobs=-1, verbose=True):
+    ''' Predicts every parameter of the bundle for the rows of a feature csv (or list of csvs), chunksize rows at a
+    time with n_jobs parallel tree evaluations, appending the predictions and identifying columns to output
+    (resuming an interrupted run) '''
+    first = next(iter_chunks(features, 1))
+    ids = [c for c in ID_COLUMNS if c in first.columns]
+    sink = FeatureSink(output, ids + bundle.parameters, strings=ids, chunk=chunksize)
+    start = sink.resume()
+    done = 0
+    t = time.time()
+    for chunk in iter_chunks(features, chunksize):
+        skip = min(max(start - done, 0), len(chunk))
+        done += len(chunk)
+        chunk = chunk.iloc[skip:]
+        if not len(chunk):
+            continue
+        with instrument.span('predict'):
+            preds = bundle.predict(chunk, n_jobs).values
+        with instrument.span('write'):
+            for idx in range(len(chunk)):
+                sink.append([chunk[c].values[idx] for c in ids] + list(preds[idx]))
+            sink.flush()
+        instrument.count('rows_predicted', len(chunk))
+        if verbose:
+            print('{} rows predicted, {:.1f} rows/s'.format(done, (done - start)/(time.time() - t)))
+    sink.close()
+
+if __name__ == "__main__":
+    if len(sys.argv) not in [4, 5]:
+        print("Usage : ./rf_model.py bundle.pkl features.csv output.csv [n_jobs]")
+        sys.exit(1)
+    predict_features(load_bundle(sys.argv[1]), sys.argv[2], sys.argv[3], n_jobs=int(sys.argv[4]) if len(sys.argv) == 5 else -1)
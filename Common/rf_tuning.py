@@ -0,0 +1,121 @@
+''' Successive-halving hyperparameter search for the random forest regressors, in place of an exhaustive GridSearchCV.
+Configurations that are equivalent on the training set are merged, each forest is grown through the n_estimators
+values of the grid by warm start rather than refitted for each, candidates are scored on a growing random subsample
+with the worst dropped each round, and the (configuration, fold) fits run in parallel across cores '''
+
+import time
+import itertools
+from multiprocessing import Pool
+
+import numpy as np
+
+from sklearn.model_selection import KFold
+from sklearn.ensemble import RandomForestRegressor
+
+_X = None
+_y = None
+
+def _init_worker(X, y):
+    ''' Gives each worker process its copy of the data once, rather than with every task '''
+    global _X, _y
+    _X, _y = X, y
+
+def _fit_fold(task):
+    ''' Grows one forest through the n_estimators values of a task on one fold of a subsample, returning the test
+    score and cumulative fit time at each '''
+    (max_depth, max_features), n_estimators, rows, train, test, seed = task
+    X_train, y_train = _X[rows[train]], _y[rows[train]]
+    X_test, y_test = _X[rows[test]], _y[rows[test]]
+    regr = RandomForestRegressor(warm_start=True, max_depth=max_depth, max_features=max_features, random_state=seed)
+    results = []
+    elapsed = 0
+    for n in n_estimators:
+        t = time.time()
+        regr.set_params(n_estimators=n)
+        regr.fit(X_train, y_train)
+        elapsed += time.time() - t
+        results.append((n, regr.score(X_test, y_test), elapsed))
+    return (max_depth, max_features), results
+
+def grown_depth(X, y, trees=10, seed=None):
+    ''' Twice the depth reached by a small forest of unbounded, fully grown trees on X, beyond which a max_depth
+    makes no difference in practice '''
+    regr = RandomForestRegressor(n_estimators=trees, max_features=1, random_state=seed).fit(X, y)
+    return 2*max(tree.tree_.max_depth for tree in regr.estimators_)
+
+def collapse_grid(grid, samples, features, depth_bound=None):
+    ''' The distinct (max_depth, max_features) forests of a GridSearchCV-style grid and their n_estimators values.
+    A tree of samples rows cannot be deeper than samples - 1 (nor, in practice, depth_bound), so larger max_depth
+    are unbounded (None), and max_features beyond the number of features all mean every feature '''
+    if depth_bound is not None:
+        samples = min(samples, depth_bound + 1)
+    structures = {}
+    for params in grid:
+        for n, depth, feats in itertools.product(params['n_estimators'], params.get('max_depth', [None]), params.get('max_features', [None])):
+            if depth is not None and depth >= samples - 1:
+                depth = None
+            if feats is not None and not isinstance(feats, str) and feats >= features:
+                feats = None
+            structures.setdefault((depth, feats), set()).add(n)
+    return {s: sorted(n) for s, n in structures.items()}
+
+class HalvingSearch():
+    ''' Successive halving over sample size: each round scores the surviving candidates by cv-fold R^2 on a random
+    subsample, keeps the best 1/factor of them and multiplies the subsample by factor, finishing on all the samples.
+    fit(X, y) sets best_params_ and best_score_ as GridSearchCV does, and results (one row per candidate per round) '''
+    def __init__(self, param_grid, cv=5, factor=3, min_samples=None, n_jobs=-1, seed=None, verbose=True):
+        self.param_grid = param_grid if isinstance(param_grid, list) else [param_grid]
+        self.cv = cv
+        self.factor = factor
+        self.min_samples = min_samples
+        self.n_jobs = None if n_jobs is None or n_jobs < 0 else n_jobs
+        self.seed = seed
+        self.verbose = verbose
+
+    def fit(self, X, y):
+        X = np.asarray(X, dtype=float)
+        y = np.asarray(y, dtype=float)
+        rng = np.random.RandomState(self.seed)
+        structures = collapse_grid(self.param_grid, len(X), X.shape[1], grown_depth(X, y, seed=self.seed))
+        candidates = sum(len(n) for n in structures.values())
+        rounds = max(int(np.ceil(np.log(candidates)/np.log(self.factor))), 1)
+        min_samples = self.min_samples or max(len(X)//self.factor**(rounds - 1), 10*self.cv)
+        if self.verbose:
+            print('{} distinct candidates, {} rounds from {} samples'.format(candidates, rounds, min(min_samples, len(X))))
+
+        self.results = []
+        with Pool(self.n_jobs, _init_worker, (X, y)) as pool:
+            for r in range(rounds):
+                samples = len(X) if r == rounds - 1 else min(min_samples*self.factor**r, len(X))
+                rows = rng.permutation(len(X))[:samples]
+                folds = list(KFold(self.cv, shuffle=True, random_state=rng.randint(2**31)).split(rows))
+                seed = rng.randint(2**31)
+                tasks = [(s, n, rows, train, test, seed) for s, n in structures.items() for train, test in folds]
+
+                t = time.time()
+                scores = {}
+                for s, results in pool.imap_unordered(_fit_fold, tasks):
+                    for n, score, elapsed in results:
+                        scores.setdefault((n,) + s, []).append((score, elapsed))
+                ranked = sorted(scores, key=lambda c: np.mean([s for s, _ in scores[c]]), reverse=True)
+                for c in ranked:
+                    row = {'round': r, 'samples': samples, 'n_estimators': c[0], 'max_depth': c[1], 'max_features': c[2],
+                           'score': np.mean([s for s, _ in scores[c]]), 'fit_time': np.mean([e for _, e in scores[c]])}
+                    self.results.append(row)
+                    if self.verbose:
+                        print('  n_estimators={n_estimators}, max_depth={max_depth}, max_features={max_features} : '
+                              'R^2 {score:.4f}, {fit_time:.2f}s per fit'.format(**row))
+                if self.verbose:
+                    print('round {}: {} candidates on {} samples in {:.1f}s'.format(r, len(ranked), samples, time.time() - t))
+
+                if r == rounds - 1 or samples == len(X):
+                    break
+                structures = {}
+                for n, depth, feats in ranked[:int(np.ceil(len(ranked)/self.factor))]:
+                    structures.setdefault((depth, feats), []).append(n)
+                structures = {s: sorted(n) for s, n in structures.items()}
+
+        best = self.results[-len(ranked)]
+        self.best_params_ = {'n_estimators': best['n_estimators'], 'max_depth': best['max_depth'], 'max_features': best['max_features']}
+        self.best_score_ = best['score']
+        return self
@@ -0,0 +1,117 @@
+''' Writes training spectra and one-hot labels to fixed-size shards on disk and streams shuffled mini-batches back
+from them, with a background thread reading ahead into a bounded queue, so a network can train on more spectra
+than fit in memory while the next batches are read during the current training step '''
+
+import os
+import json
+import queue
+import threading
+
+import numpy as np
+
+MANIFEST = 'shards.json'
+
+def is_sharded(path):
+    ''' Checks whether a path points to a directory written by write_shards '''
+    return isinstance(path, str) and os.path.isfile(os.path.join(path, MANIFEST))
+
+def write_shards(chunks, shard_dir, shard_size=10000):
+    ''' Writes an iterable of (flux, labels) chunks to shard_dir as shards of shard_size rows '''
+    os.makedirs(shard_dir, exist_ok=True)
+    counts = []
+    buff_x, buff_y = [], []
+    buffered = 0
+
+    def dump(x, y):
+        name = 'shard_{:05d}'.format(len(counts))
+        np.save(os.path.join(shard_dir, name + '.flux.npy'), np.asarray(x, dtype=np.float32))
+        np.save(os.path.join(shard_dir, name + '.label.npy'), np.asarray(y, dtype=np.float32))
+        counts.append(len(x))
+
+    for x, y in chunks:
+        buff_x.append(x)
+        buff_y.append(y)
+        buffered += len(x)
+        while buffered >= shard_size:
+            x, y = np.concatenate(buff_x), np.concatenate(buff_y)
+            dump(x[:shard_size], y[:shard_size])
+            buff_x, buff_y = [x[shard_size:]], [y[shard_size:]]
+            buffered -= shard_size
+    if buffered:
+        dump(np.concatenate(buff_x), np.concatenate(buff_y))
+    with open(os.path.join(shard_dir, MANIFEST), 'w') as f:
+        json.dump({'counts': counts}, f)
+    return sum(counts)
+
+def store_shards(store, rows, labels, classes, shard_dir, pixels=3500, shard_size=10000):
+    ''' Writes the normalised flux of rows of a SpectrumStore and the one-hot encoding of their integer labels
+    (out of classes) to shards, a shard at a time '''
+    onehot = np.eye(classes, dtype=np.float32)
+    chunks = ((store.get_flux(rows[i:i+shard_size], pixels), onehot[labels[i:i+shard_size]])
+              for i in range(0, len(rows), shard_size))
+    return write_shards(chunks, shard_dir, shard_size)
+
+class ShardStream():
+    ''' An endless iterator of shuffled (flux, labels) batches of batch_size drawn from the shards in shard_dir.
+    Each epoch visits the shards in a random order, mix at a time, shuffling the rows of the mix; a producer
+    thread keeps up to prefetch batches ready '''
+    def __init__(self, shard_dir, batch_size, prefetch=8, mix=2, seed=None):
+        self.shard_dir = shard_dir
+        with open(os.path.join(shard_dir, MANIFEST)) as f:
+            self.counts = json.load(f)['counts']
+        self.samples = sum(self.counts)
+        self.batch_size = min(batch_size, self.samples)
+        self.mix = mix
+        self.rng = np.random.RandomState(seed)
+        self.queue = queue.Queue(maxsize=prefetch)
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._produce, daemon=True)
+        self.thread.start()
+
+    def _load(self, shard):
+        name = os.path.join(self.shard_dir, 'shard_{:05d}'.format(shard))
+        return np.load(name + '.flux.npy'), np.load(name + '.label.npy')
+
+    def _put(self, item):
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self):
+        try:
+            left_x, left_y = None, None
+            while not self.stop.is_set():
+                order = self.rng.permutation(len(self.counts))
+                for i in range(0, len(order), self.mix):
+                    loaded = [self._load(s) for s in order[i:i+self.mix]]
+                    x = np.concatenate([l[0] for l in loaded])
+                    y = np.concatenate([l[1] for l in loaded])
+                    perm = self.rng.permutation(len(x))
+                    x, y = x[perm], y[perm]
+                    if left_x is not None:
+                        x, y = np.concatenate((left_x, x)), np.concatenate((left_y, y))
+                    n = len(x) - len(x) % self.batch_size
+                    for j in range(0, n, self.batch_size):
+                        if not self._put((x[j:j+self.batch_size], y[j:j+self.batch_size])):
+                            return
+                    left_x, left_y = x[n:], y[n:]
+        except Exception as e:
+            self._put(e)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = self.queue.get()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def close(self):
+        ''' Stops the producer thread '''
+        self.stop.set()
+        self.thread.join()
@@ -0,0 +1,155 @@
+''' Spectrum sources: LAMOST releases ship as gzipped fits files bundled in tar archives, and these are read where
+they lie rather than unpacked to disk first. expand turns a list of paths into fits sources, keeping .fits and
+.fits.gz paths as they are and replacing each tar archive with its fits members. imap_threads reads sources in a
+pool of threads (the gzip decompression releases the GIL) while handing them on in order, and read_sources combines
+the two to read the rows of every spectrum in a list of paths.
+
+expand is a generator and its consumers keep only a window of it in flight (Bounded holds back Pool.imap, which
+otherwise drains its input at once), so an archive is never held in memory whole. A member of a plain tar is read by
+seeking to its data, so members are small picklable objects that can be read in any order, by any thread or worker
+process. A compressed tarball can only be decompressed in sequence, so each of its members is read into memory when
+expand reaches it; plain tars of .fits.gz files (the LAMOST layout) are preferred for large bundles '''
+
+import os
+import glob
+import tarfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from lamost_fits import read_rows, FLUX, USED_CARDS
+
+FITS_SUFFIXES = ('.fits', '.fits.gz', '.fit', '.fit.gz')
+ARCHIVE_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+
+def is_fits(name):
+    ''' Whether a file or member name is a (possibly gzipped) fits file '''
+    return name.lower().endswith(FITS_SUFFIXES)
+
+def is_archive(name):
+    ''' Whether a path is a tar archive '''
+    return name.lower().endswith(ARCHIVE_SUFFIXES)
+
+class Member():
+    ''' A fits file stored in a plain tar archive, read by seeking to its data '''
+    __slots__ = ('archive', 'name', 'offset', 'size')
+
+    def __init__(self, archive, name, offset, size):
+        self.archive = archive
+        self.name = name
+        self.offset = offset
+        self.size = size
+
+    def read(self):
+        with open(self.archive, 'rb') as f:
+            f.seek(self.offset)
+            return f.read(self.size)
+
+    def __str__(self):
+        return self.archive + ':' + self.name
+
+    __repr__ = __str__
+
+class Payload():
+    ''' A fits file already read out of a compressed tarball '''
+    __slots__ = ('archive', 'name', 'data', 'size')
+
+    def __init__(self, archive, name, data):
+        self.archive = archive
+        self.name = name
+        self.data = data
+        self.size = len(data)
+
+    def read(self):
+        return self.data
+
+    def __str__(self):
+        return self.archive + ':' + self.name
+
+    __repr__ = __str__
+
+def archive_members(path):
+    ''' Yields a Member or Payload for every fits file in a tar archive, in archive order '''
+    if path.lower().endswith('.tar'):
+        with tarfile.open(path, 'r:') as tar:
+            for info in tar:
+                if info.isfile() and is_fits(info.name):
+                    yield Member(path, info.name, info.offset_data, info.size)
+    else:
+        with tarfile.open(path, 'r|*') as tar:
+            for info in tar:
+                if info.isfile() and is_fits(info.name):
+                    yield Payload(path, info.name, tar.extractfile(info).read())
+
+def expand(paths):
+    ''' Yields the fits sources of a list of .fits, .fits.gz and tar archive paths (sources that are already archive
+    members are passed on as they are) '''
+    for path in paths:
+        if isinstance(path, str) and is_archive(path):
+            yield from archive_members(path)
+        else:
+            yield path
+
+def find_sources(directory):
+    ''' The fits files, gzipped fits files and tar archives in a directory, sorted by name '''
+    return sorted(f for f in glob.glob(os.path.join(directory, '*')) if is_fits(f) or is_archive(f))
+
+class Bounded():
+    ''' Hands the items of an iterable to a consumer that reads ahead, such as Pool.imap (whose feeder thread drains
+    its input at once), keeping at most window items handed over but not yet taken back with done(). done returns
+    the item each in-order result belongs to. window must be at least the consumer's chunk size '''
+    def __init__(self, items, window):
+        self.items = iter(items)
+        self.window = window
+        self.slots = threading.Semaphore(window)
+        self.pending = deque()
+        self.closed = False
+
+    def __iter__(self):
+        while True:
+            self.slots.acquire()
+            if self.closed:
+                return
+            try:
+                item = next(self.items)
+            except StopIteration:
+                return
+            self.pending.append(item)
+            yield item
+
+    def done(self):
+        self.slots.release()
+        return self.pending.popleft()
+
+    def close(self):
+        ''' Stops handing over items, releasing a consumer waiting for one (so that a pool can be shut down) '''
+        self.closed = True
+        for _ in range(self.window):
+            self.slots.release()
+
+def _call(fn, item):
+    try:
+        return item, fn(item), None
+    except Exception as e:
+        return item, None, e
+
+def imap_threads(fn, items, threads=None, window=256):
+    ''' Applies fn to every item of an iterable in a pool of threads, yielding (item, result, error) in order with
+    error the exception raised by fn (and result None) if it failed. At most window items are in flight at once, so
+    the iterable is consumed lazily '''
+    with ThreadPoolExecutor(threads) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(_call, fn, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def read_sources(paths, rows=(FLUX,), keys=USED_CARDS, threads=None):
+    ''' Yields (source, rows, cards) for every fits source of a list of .fits, .fits.gz and tar archive paths, read
+    with lamost_fits.read_rows in a pool of threads, raising the error of the first source that cannot be read '''
+    for source, result, error in imap_threads(lambda source: read_rows(source, rows, keys), expand(paths), threads):
+        if error is not None:
+            raise error
+        yield (source,) + result
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+''' Packs a directory of LAMOST fits files into a single memory-mapped flux array and a header table,
+so that training scripts can load tens of thousands of spectra without reopening every fits file. The files may be
+gzipped or bundled in tar archives (see spectrum_sources) '''
+
+import os
+import sys
+import glob
+import time
+from functools import partial
+from itertools import islice
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+import instrument
+from lamost_fits import HEADER_COLUMNS, SNR_BANDS, mk_class, read_spectrum, source_size
+from spectrum_sources import Bounded, expand, imap_threads
+
+FLUX_FILE = 'flux.npy'
+HEADER_FILE = 'headers.csv'
+PIXELS = 3904
+
+def is_store(path):
+    ''' Checks whether a path points to a spectrum store rather than a glob of fits files '''
+    return isinstance(path, str) and os.path.isfile(os.path.join(path, HEADER_FILE))
+
+def _write_header(f, samples, pixels):
+    ''' Writes the .npy header of a float32 (samples, pixels) array at the start of f. The header is padded to the
+    same length for any row count, so it is rewritten in place once the number of spectra stored is known '''
+    f.seek(0)
+    np.lib.format.write_array_header_1_0(f, {'descr': '<f4', 'fortran_order': False, 'shape': (samples, pixels)})
+    return f.tell()
+
+def build_store(files, store_dir, pixels=PIXELS, threads=None, verbose=True):
+    ''' Reads each fits file (or fits member of a tar archive) once, decompressing in a pool of threads, and writes
+    its flux (padded or cut to pixels) and header cards to store_dir. The sources are streamed, so tar archives are
+    never held in memory whole '''
+    os.makedirs(store_dir, exist_ok=True)
+    rows = []
+    ti = time.time()
+    with open(os.path.join(store_dir, FLUX_FILE), 'wb') as out, instrument.span('read'):
+        offset = _write_header(out, 0, pixels)
+        flux = np.empty(pixels, dtype='<f4')
+        for idx, (f, result, error) in enumerate(imap_threads(read_spectrum, expand(files), threads)):
+            if error is not None:
+                print('Failed for file : ', f)
+                instrument.count('files_failed')
+                continue
+            flx, row = result
+            n = min(len(flx), pixels)
+            flux[:n] = flx[:n]
+            flux[n:] = np.nan
+            out.write(flux.tobytes())
+            rows.append(row)
+            if verbose and idx % 1000 == 0:
+                print('{} files stored, {:.1f}s'.format(idx, time.time() - ti))
+        if _write_header(out, len(rows), pixels) != offset:
+            raise ValueError('Flux array header changed length')
+    pd.DataFrame(rows, columns=HEADER_COLUMNS).to_csv(os.path.join(store_dir, HEADER_FILE), index=False)
+    if verbose:
+        print('Stored {} spectra in {:.1f}s'.format(len(rows), time.time() - ti))
+    return SpectrumStore(store_dir)
+
+class SpectrumStore():
+    ''' Read-only access to the flux array and header table written by build_store '''
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.flux = np.load(os.path.join(store_dir, FLUX_FILE), mmap_mode='r')
+        self.headers = pd.read_csv(os.path.join(store_dir, HEADER_FILE), keep_default_na=False,
+                                   na_values={'SNR' + b: [''] for b in SNR_BANDS})
+
+    def __len__(self):
+        return len(self.headers)
+
+    def select(self, SNR=0):
+        ''' Returns the rows with an SNR of at least SNR in any band '''
+        snr = self.headers[['SNR' + b for b in SNR_BANDS]].values
+        rows = np.where(np.any(snr >= SNR, axis=1))[0]
+        instrument.count('spectra_rejected_snr', len(snr) - len(rows))
+        return rows
+
+    def get_flux(self, rows=None, pixels=None, normalise=True):
+        ''' Copies the flux of the given rows (all by default) into memory, optionally normalised to unit sum '''
+        if rows is None:
+            rows = np.arange(len(self))
+        flux = np.array(self.flux[rows, :pixels])
+        if normalise:
+            flux = flux/np.sum(flux, axis=1, keepdims=True)
+        return flux
+
+    def get_classes(self, rows=None, MK=False):
+        ''' Returns the LAMOST class of the given rows, replacing STAR with the MK type if MK is set '''
+        df = self.headers if rows is None else self.headers.iloc[rows]
+        if not MK:
+            return df['CLASS'].values
+        return np.array([mk_class(c, s) for c, s in zip(df['CLASS'].values, df['SUBCLASS'].values)])
+
+    def get_wavelength(self, row):
+        ''' Rebuilds the wavelength grid of a row from its COEFF0 and COEFF1 cards '''
+        init = self.headers['COEFF0'].values[row]
+        disp = self.headers['COEFF1'].values[row]
+        return 10**(init + disp*np.arange(self.flux.shape[1]))
+
+def read_normalised(path, pixels=PIXELS):
+    ''' Worker function returning the flux of one fits file padded or cut to pixels and normalised to unit sum,
+    with its header row, or None if the file cannot be read '''
+    try:
+        flx, row = read_spectrum(path)
+    except Exception:
+        return None
+    flux = np.full(pixels, np.nan, dtype=np.float32)
+    n = min(len(flx), pixels)
+    flux[:n] = flx[:n]
+    return flux/np.sum(flux[:n]), row
+
+def stream_spectra(source, pixels=PIXELS, batch=10000, start=0, processes=None, chunksize=100):
+    ''' Yields (flux, headers, inputs) for batches of up to batch normalised spectra of a spectrum store or a list of
+    fits files and tar archives of them (read over a pool of worker processes), beginning at input start. inputs
+    counts the files consumed by the batch, including any that could not be read (which are reported and skipped) '''
+    if is_store(source):
+        store = SpectrumStore(source)
+        for i in range(start, len(store), batch):
+            rows = np.arange(i, min(i + batch, len(store)))
+            with instrument.span('read'):
+                flux = store.get_flux(rows, pixels)
+            yield flux, store.headers.iloc[rows].reset_index(drop=True), len(rows)
+        return
+    sources = Bounded(islice(expand(source), start, None), 2*chunksize*(processes or os.cpu_count()))
+    with Pool(processes) as pool:
+        try:
+            flux, rows, inputs = [], [], 0
+            for result in pool.imap(partial(read_normalised, pixels=pixels), sources, chunksize):
+                f = sources.done()
+                inputs += 1
+                if result is None:
+                    print('Failed for file : ', f)
+                    instrument.count('files_failed')
+                else:
+                    if instrument.enabled():
+                        instrument.count('files_read')
+                        instrument.count('bytes_read', source_size(f))
+                    flux.append(result[0])
+                    rows.append(result[1])
+                if inputs == batch:
+                    yield np.array(flux).reshape(-1, pixels), pd.DataFrame(rows, columns=HEADER_COLUMNS), inputs
+                    flux, rows, inputs = [], [], 0
+            if inputs:
+                yield np.array(flux).reshape(-1, pixels), pd.DataFrame(rows, columns=HEADER_COLUMNS), inputs
+        finally:
+            sources.close()
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage : ./spectrum_store.py 'fits_or_tar_glob' store_dir")
+        sys.exit(1)
+    build_store(sorted(glob.glob(sys.argv[1])), sys.argv[2])
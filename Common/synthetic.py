@@ -0,0 +1,56 @@
+''' Whole-array generation of the synthetic training spectra used by the neural nets: noisy blackbodies labelled by
+MK class and straight-line "galaxy" spectra, produced N at a time (or streamed in batches) rather than one spectrum
+and one pixel at a time '''
+
+import numpy as np
+
+from blackbody import blackbody
+
+WAVELENGTH = np.linspace(3000, 9000, 3001)
+MK_CLASSES = ['O', 'B', 'A', 'F', 'G', 'K', 'M', 'Other']
+MK_TEMPS = [30000, 10000, 7500, 6000, 5200, 3700, 2400]
+
+def lines(ends, wavelength):
+    ''' Straight-line spectra running from ends[:, 0] at the first wavelength to ends[:, 1] at the last '''
+    ends = np.asarray(ends, dtype=float).reshape(-1, 2)
+    frac = (np.asarray(wavelength) - wavelength[0])/(wavelength[-1] - wavelength[0])
+    return ends[:, :1] + (ends[:, 1:] - ends[:, :1])*frac
+
+def normalise(spectra):
+    ''' Scales each spectrum to unit sum '''
+    return spectra/np.sum(spectra, axis=1, keepdims=True)
+
+def poisson_noise(spectra, var_scale=1, rng=np.random):
+    ''' Adds gaussian noise with a variance of var_scale times the signal in each pixel '''
+    return spectra + rng.normal(0, 1, spectra.shape)*np.sqrt(var_scale*spectra)
+
+def temperature_class(temps, thresholds=MK_TEMPS, strict=False):
+    ''' Index of the first of the descending thresholds each temperature reaches (exceeds, if strict), with
+    len(thresholds) for temperatures below them all and nans '''
+    temps = np.asarray(temps, dtype=float).reshape(-1, 1)
+    idx = np.sum(temps <= thresholds if strict else temps < thresholds, axis=1)
+    idx[np.isnan(temps[:, 0])] = len(thresholds)
+    return idx
+
+def hot_vectors(temps):
+    ''' One-hot MK class vectors of temperatures, as Neural_Network.hot_v (nan goes to "Other") '''
+    return np.eye(len(MK_CLASSES), dtype=int)[temperature_class(temps)]
+
+def make_spectra(samples, line_frac, wavelength=WAVELENGTH, rng=np.random):
+    ''' The synthetic set of Neural_Network.make_spectra: line_frac lines and otherwise blackbodies with beta-distributed
+    temperatures, normalised and given Poisson-like noise at 10 to 240 counts per spectrum. Returns the spectra,
+    their one-hot MK labels and the temperatures (nan for lines) '''
+    temps = rng.beta(2, 6, samples)*10000 + 2400
+    temps[rng.random_sample(samples) <= line_frac] = np.nan
+    spectra = np.empty((samples, len(wavelength)))
+    bb = ~np.isnan(temps)
+    spectra[bb] = blackbody(temps[bb], wavelength)
+    spectra[~bb] = normalise(lines(rng.random_sample((np.sum(~bb), 2)), wavelength))
+    spectra = poisson_noise(spectra*rng.uniform(10, 240, (samples, 1)), rng=rng)
+    return spectra, hot_vectors(temps), temps
+
+def stream_spectra(batch_size, line_frac, wavelength=WAVELENGTH, seed=None):
+    ''' Yields (spectra, labels) batches of make_spectra indefinitely '''
+    rng = np.random.RandomState(seed)
+    while True:
+        yield make_spectra(batch_size, line_frac, wavelength, rng)[:2]
@@ -1,6 +1,3 @@
 #!/bin/bash
 
-for i in {0..10..1};
-do
-    ./readfits.py $i
-done
+../Chris/Temp_Model/read_fits.py --chunksize 100 --output output.csv
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+import glob
+import time
+import os
+import sys
+
+import tensorflow as tf
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Common'))
+from spectrum_store import is_store, stream_spectra
+from feature_sink import FeatureSink
+
+def load_model(sess, folder):
+    'restore the conv net checkpointed by Neural_Network.train_conv into sess, returning its input, keep_prob and probability tensors and the class names'
+    saver = tf.train.import_meta_graph('Files/' + folder + '/model.ckpt.meta')
+    saver.restore(sess, 'Files/' + folder + '/model.ckpt')
+    graph = tf.get_default_graph()
+    x = graph.get_tensor_by_name('x:0')
+    keep_prob = graph.get_tensor_by_name('keep_prob:0')
+    probabilities = graph.get_tensor_by_name('probabilities:0')
+    classes = list(np.loadtxt('Files/' + folder + '/classes.csv', dtype = 'str', delimiter = ',', ndmin = 1))
+    return x, keep_prob, probabilities, classes
+
+def classify(folder, source, output, batch = 10000, processes = None):
+    'stream a spectrum store or list of fits files through a saved conv net in batches, writing the predicted class (as predicted_CLASS, apart from the LAMOST CLASS) and the probability of each class per designation to output (resuming an interrupted run)'
+    with tf.Session() as sess:
+        x, keep_prob, probabilities, classes = load_model(sess, folder)
+        pixels = int(x.shape[1])
+
+        columns = ['designation', 'filename', 'predicted_CLASS'] + classes
+        sink = FeatureSink(output, columns, strings = ['designation', 'filename', 'predicted_CLASS'], chunk = batch)
+        start = sink.resume()
+        if start: print('resuming from spectrum {}'.format(start))
+
+        t = time.time()
+        done = start
+        for flux, headers, inputs in stream_spectra(source, pixels, batch, start, processes):
+            probs = sess.run(probabilities, feed_dict = {x: flux, keep_prob: 1.0}) if len(flux) else np.empty((0, len(classes)))
+            predicted = np.array(classes)[np.argmax(probs, axis = 1)] if len(flux) else []
+            for idx in range(len(flux)):
+                sink.append([headers['designation'].values[idx], headers['filename'].values[idx], predicted[idx], *probs[idx]])
+            for idx in range(inputs - len(flux)):
+                sink.skip()
+            sink.flush()
+                #checkpoint whole batches, so a resumed run restarts at the first spectrum of the next batch
+            done += inputs
+            print('{} spectra classified, {:.1f} spectra/s'.format(done, (done - start)/(time.time() - t)))
+        sink.close()
+
+if __name__ == "__main__":
+    if len(sys.argv) not in [4, 5]:
+        print("Usage : ./classify.py model_folder 'fits_or_tar_glob'|store_dir output.csv [batch]")
+        sys.exit(1)
+    source = sys.argv[2] if is_store(sys.argv[2]) else sorted(glob.glob(sys.argv[2]))
+    classify(sys.argv[1], source, sys.argv[3], *[int(b) for b in sys.argv[4:]])
@@ -1,31 +1,32 @@
-import pandas as pd
-from astropy.io import fits
 import glob
+import os
+import sys
 
 import time
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Common'))
+from fits_index import build_index, query_index
+from catalog_store import read_catalog
+import instrument
+
 print('Opening catalog...')
 t = time.time()
 cfile = '/data2/cpb405/dr1.csv'
-catalog = pd.read_csv(cfile, sep='|')
-catalog.drop_duplicates(subset = 'designation', inplace = True)
-print('Catalog opened: 'time.time() - t, '\nReading in FITS files...')
+with instrument.span('read_catalog'):
+    catalog = read_catalog(cfile, ['designation', 'class', 'subclass'])
+print('Catalog opened: ', time.time() - t, '\nReading in FITS headers...')
 
 sfile = '/data2/mrs493/DR1_3/*.fits'
-files = glob.glob(sfile)
-
-keys = ['designation', 'filename']
+index = '/data2/mrs493/DR1_3/index.db'
 
-dr1 = pd.DataFrame(columns=keys)
 t = time.time()
-for fitsName in files:
-    with fits.open(fitsName) as hdulist:    
-        df = pd.DataFrame(columns=keys)
-        df.loc[0] = [hdulist[0].header['DESIG'][7:], hdulist[0].header['FILENAME']]
-        dr1 = pd.concat([dr1, df])
-print('FITS files read: 'time.time() - t, '\nMerging DataFrames')
+with instrument.span('read_headers'):
+    if not os.path.isfile(index): build_index(glob.glob(sfile), index)
+    dr1 = query_index(index, columns = ['designation', 'filename'])
+print('FITS headers read: ', time.time() - t, '\nMerging DataFrames')
 
-df = catalog.merge(dr1, on='designation', how='inner')
+with instrument.span('join'):
+    df = catalog.merge(dr1, on='designation', how='inner')
 
 classification = df['class'].values
 STAR = [classification == 'STAR']
@@ -35,4 +36,4 @@ df['classification'] = classification
 file = 'classification.csv'
 
 df[['filename', 'classification']].to_csv(file, index = False)
-print('DataFrames Merged\nResult saved to ', file)
\ No newline at end of file
+print('DataFrames Merged\nResult saved to ', file)
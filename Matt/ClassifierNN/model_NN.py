@@ -2,16 +2,27 @@ from plot_model import plot_results
 
 import pandas as pd
 import numpy as np
-from astropy.io import fits
 from sklearn.preprocessing import LabelEncoder, OneHotEncoder
 
 import matplotlib.pyplot as plt
 
 import glob
 import time
+import os
+import sys
 
 import tensorflow as tf
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Common'))
+from spectrum_store import SpectrumStore, is_store
+from spectrum_sources import read_sources
+from fits_index import is_index, select_files
+from shard_stream import ShardStream, store_shards
+from batch_sampler import BatchSampler
+from chunked_eval import ChunkedEvaluator
+import synthetic
+import instrument
+
 '''
 CLASS --- DR3 --- TRAINING
 A --- 275405 --- 1123
@@ -34,7 +45,8 @@ T_Star --- 5268415 --- 21676
 
 class Neural_Network:
     def __init__(self):
-        pass
+        self.train_shards = None
+        self.train_stream = None
     
     def weight_variable(self, shape):
         'create a variable of the specified shape, whith values initialised using a normal distribution with sigma = 0.1'
@@ -56,39 +68,21 @@ class Neural_Network:
     
     def blackbody(self, T):
         'create a black body spectrum at temperature t and normalise it'
-        wavelength = np.linspace(3000, 9000, 3001)
-        h = 6.63e-34
-        c = 3e8
-        k = 1.38e-23
-        spec = ((8*np.pi*h*c)/((wavelength*1e-10)**5*(np.exp(h*c/((wavelength*1e-10)*k*T))-1)))/(T*55.8)
-        return self.noise(spec/np.sum(spec))
+        return self.noise(synthetic.blackbody(T, synthetic.WAVELENGTH)[0])
     
     def line(self):
         'create a line spectrum and normalise it'
-        wavelength = np.linspace(3000, 9000, 3001)
-        ends = np.random.random(2)
-        m = (ends[1] - ends[0])/(wavelength[-1] - wavelength[0])
-        c = ends[0] - m*wavelength[0]
-        line = (m*wavelength + c)
-        return self.noise(line/np.sum(line))
+        line = synthetic.normalise(synthetic.lines(np.random.random(2), synthetic.WAVELENGTH))
+        return self.noise(line[0])
     
     def noise(self, spectrum):
+        'scale a normalised spectrum to between 10 and 240 counts and add Poisson-like noise'
         r = np.random.uniform(10, 240)
-        sp = [np.random.normal(s*r, np.sqrt(s*r)) for s in spectrum]
-        return sp
+        return synthetic.poisson_noise(np.asarray(spectrum)*r)
 
     def hot_v(self, t):
         'take a temperature, and return a hot vector for the MK class of a star at that temp (Nan goes to "Other")'
-        hot = [0]*8
-        if t>= 30000: hot[0] = 1
-        elif t>=10000: hot[1] = 1
-        elif t>=7500: hot[2] = 1
-        elif t>=6000: hot[3] = 1
-        elif t>=5200: hot[4]= 1
-        elif t>=3700: hot[5] = 1
-        elif t>=2400: hot[6] = 1
-        else: hot[-1] = 1
-        return hot
+        return list(synthetic.hot_vectors(t)[0])
 
     def train_test_split(self, train_frac):
         'split the data into a train and a test set, with train_frac of the points in the training set'
@@ -103,13 +97,15 @@ class Neural_Network:
         self.file_train = np.array(self.files[split])
         self.file_test = np.array(self.files[[not s for s in split]])
         
-    def batch(self, batch_frac):
-        'return a batch of size batch_frac relative to the train set'
-        batch = np.random.random(len(self.x_train))<=batch_frac
-        batch_x = self.x_train[batch]
-        batch_y = self.y_train[batch]
-        return batch_x, batch_y
+    def batches(self, batch_frac, stratified = False):
+        'return an iterator of training batches of batch_frac of the train set, reshuffled each epoch (optionally stratified by class), streamed from disk with read-ahead if the training set was sharded, or generated if it is synthetic'
+        if self.train_stream is not None:
+            return self.train_stream
+        if self.train_shards is None:
+            return BatchSampler(self.x_train, self.y_train, max(1, int(batch_frac*len(self.x_train))), stratified)
+        return ShardStream(self.train_shards, max(1, int(batch_frac*self.train_samples)))
     
+    @instrument.timed('save')
     def save(self, folder, conf, accuracies, w1, w2):
         'save the results of the model to .csv files'
         np.savetxt('Files/' + folder + '/classes.csv', self.classes, fmt = '%s', delimiter = ',')
@@ -127,78 +123,82 @@ class Neural_Network:
                 np.savetxt(outfile, flter, fmt = '%s', delimiter = ',')
                 outfile.write('#New filter\n')
 
+    @instrument.timed('generate')
     def make_spectra(self, samples, line_frac): 
-        'produce a test data set of samples spectra, of which line_frac are lines and the remained are blackbodies with a uniform distribution of temperatures'
+        'produce a test data set of samples spectra, of which line_frac are lines and the remained are blackbodies with a beta distribution of temperatures'
         self.samples = samples
         
         ti = time.time()
         print('generating data...')
         
-        self.classes = ['O', 'B', 'A', 'F', 'G', 'K', 'M', 'Other']
+        self.classes = synthetic.MK_CLASSES
         
         self.cls = len(self.classes)
         
-        temps = np.random.beta(2,6,samples)*10000 + 2400
-        
-        #temps = np.random.uniform(2400, 33000, samples)
-        
-        temps[np.random.random(len(temps))<=line_frac] = np.nan
-        
-        spectra = []
-        label = []
-        
-        for t in temps:
-            if t!=t: spectrum = self.line()
-            else: spectrum = self.blackbody(t)
-            hot = self.hot_v(t)
-            label.append(hot)
-            spectra.append(spectrum)
-        
-        self.wavelengths = len(spectra[0])
+        self.spectra, self.label, temps = synthetic.make_spectra(samples, line_frac)
+        self.files = np.array(['synthetic_{}'.format(i) for i in range(samples)])
         
-        self.spectra = np.array(spectra)
-        self.label = np.array(label)
+        self.wavelengths = self.spectra.shape[1]
         
         print('data generated: ', time.time() - ti)
+        
+    def stream_spectra(self, batch_size, line_frac, test_samples):
+        'generate a fixed synthetic test set of test_samples spectra and train on an endless stream of fresh synthetic batches'
+        self.make_spectra(test_samples, line_frac)
+        self.x_test, self.y_test, self.file_test = self.spectra, self.label, self.files
+        self.train_stream = synthetic.stream_spectra(batch_size, line_frac)
+
+    def read_store(self, store_dir, MK = False, SNR = None):
+        'read the normalised flux, classes and filenames of the spectra in a spectrum store (only those with an SNR of at least SNR in any band, if SNR is given)'
+        store = SpectrumStore(store_dir)
+        rows = np.arange(len(store)) if SNR is None else store.select(SNR)
+        flux = store.get_flux(rows, self.wavelengths)
+        CLASS = store.get_classes(rows, MK)
+        files = store.headers['filename'].values[rows]
+        return flux, CLASS, files
 
+    @instrument.timed('read')
     def get_LAMOST(self, Ldir, MK = False, SNR = 0):
-        'read in the spectra from the LAMOST data'
+        'read in the spectra from the LAMOST data (a glob of fits, fits.gz or tar files, a header index .db or a spectrum store directory)'
         
         ti = time.time()
         print('reading data...')
         
-        train_files = glob.glob(Ldir)
-        
-        flux = []
-        CLASS = []
-        files = []
-        
         self.wavelengths = 3500
         
-        for idx, file in enumerate(train_files):
-            with fits.open(file) as hdulist:
-                flx = hdulist[0].data[0]
-                flx = flx[:self.wavelengths]
-                flx = flx/np.sum(flx)
-                CLS = hdulist[0].header['CLASS']
-                fn = hdulist[0].header['FILENAME']
-                if MK and CLS=='STAR': CLS = hdulist[0].header['SUBCLASS'][0]
-                try:
-                    U = hdulist[0].header['SNRU']
-                    G = hdulist[0].header['SNRG']
-                    R = hdulist[0].header['SNRR']
-                    I = hdulist[0].header['SNRI']
-                    Z = hdulist[0].header['SNRZ']
-                except:
-                    U = hdulist[0].header['SN_U']
-                    G = hdulist[0].header['SN_G']
-                    R = hdulist[0].header['SN_R']
-                    I = hdulist[0].header['SN_I']
-                    Z = hdulist[0].header['SN_Z']
+        if is_store(Ldir):
+            flux, CLASS, files = self.read_store(Ldir, MK, SNR)
+            train_files = []
+        else:
+            train_files = select_files(Ldir, SNR) if is_index(Ldir) else glob.glob(Ldir)
+            flux = []
+            CLASS = []
+            files = []
+        
+        for idx, (file, data, header) in enumerate(read_sources(train_files)):
+            flx = data[0]
+            flx = flx[:self.wavelengths]
+            flx = flx/np.sum(flx)
+            CLS = header['CLASS']
+            fn = header['FILENAME']
+            if MK and CLS=='STAR': CLS = header['SUBCLASS'][0]
+            try:
+                U = header['SNRU']
+                G = header['SNRG']
+                R = header['SNRR']
+                I = header['SNRI']
+                Z = header['SNRZ']
+            except:
+                U = header['SN_U']
+                G = header['SN_G']
+                R = header['SN_R']
+                I = header['SN_I']
+                Z = header['SN_Z']
             if U>=SNR or G>=SNR or R>=SNR or I>=SNR or Z>=SNR:
                 flux.append(flx)
                 CLASS.append(CLS)
                 files.append(fn)
+            else: instrument.count('spectra_rejected_snr')
         
         le = LabelEncoder()
         CLAS = le.fit_transform(CLASS)
@@ -225,26 +225,63 @@ class Neural_Network:
             
         ti = time.time()
         
-    def get_LAMOST_tt(self, train_dir, test_dir, MK = False):
-        'read in the spectra from the LAMOST data'
+    @instrument.timed('shard')
+    def shard_LAMOST(self, store_dir, shard_dir, train_frac, MK = False, SNR = 0):
+        'split a spectrum store into a training set written to shards on disk and a test set held in memory, so the training set is bounded by disk rather than memory'
         
         ti = time.time()
-        print('reading training data...')
+        print('sharding data...')
+        
+        self.wavelengths = 3500
+        
+        store = SpectrumStore(store_dir)
+        rows = store.select(SNR)
+        CLASS = store.get_classes(rows, MK)
+        
+        le = LabelEncoder()
+        CLAS = le.fit_transform(CLASS)
+        
+        self.classes = le.inverse_transform(np.arange(np.amax(CLAS)+1))
+        
+        self.cls = len(self.classes)
+        
+        split = np.random.random(len(rows))<=train_frac
+        
+        self.train_samples = store_shards(store, rows[split], CLAS[split], self.cls, shard_dir, self.wavelengths)
+        self.train_shards = shard_dir
         
-        train_files = glob.glob(train_dir)
+        self.x_test = store.get_flux(rows[~split], self.wavelengths)
+        self.y_test = np.eye(self.cls)[CLAS[~split]]
+        self.file_test = store.headers['filename'].values[rows[~split]]
         
-        flux = []
-        CLASS = []
+        print('data sharded: ', time.time() - ti, '\ndata contents:')
+        
+        for i in range(self.cls):
+            print(self.classes[i], ': ', np.sum(CLAS==i))
+        
+    @instrument.timed('read')
+    def get_LAMOST_tt(self, train_dir, test_dir, MK = False):
+        'read in the spectra from the LAMOST data (globs of fits, fits.gz or tar files, or spectrum store directories)'
+        
+        ti = time.time()
+        print('reading training data...')
         
         self.wavelengths = 3500
         
-        for idx, file in enumerate(train_files):
-            with fits.open(file) as hdulist:
-                flx = hdulist[0].data[0]
-                flx = flx[:self.wavelengths]
-                flx = flx/np.sum(flx)
-                CLS = hdulist[0].header['CLASS']
-                if MK and CLS=='STAR': CLS = hdulist[0].header['SUBCLASS'][0]
+        if is_store(train_dir):
+            flux, CLASS, _ = self.read_store(train_dir, MK)
+            train_files = []
+        else:
+            train_files = glob.glob(train_dir)
+            flux = []
+            CLASS = []
+        
+        for idx, (file, data, header) in enumerate(read_sources(train_files)):
+            flx = data[0]
+            flx = flx[:self.wavelengths]
+            flx = flx/np.sum(flx)
+            CLS = header['CLASS']
+            if MK and CLS=='STAR': CLS = header['SUBCLASS'][0]
             flux.append(flx)
             CLASS.append(CLS)
         
@@ -270,18 +307,20 @@ class Neural_Network:
         
         print('reading test data...')
         
-        test_files = glob.glob(test_dir)
-        
-        flux2 = []
-        CLASS2 = []
-        
-        for idx, file in enumerate(test_files):
-            with fits.open(file) as hdulist:
-                flx = hdulist[0].data[0]
-                flx = flx[:self.wavelengths]
-                flx = flx/np.sum(flx)
-                CLS = hdulist[0].header['CLASS']
-                if MK and CLS=='STAR': CLS = hdulist[0].header['SUBCLASS'][0]
+        if is_store(test_dir):
+            flux2, CLASS2, _ = self.read_store(test_dir, MK)
+            test_files = []
+        else:
+            test_files = glob.glob(test_dir)
+            flux2 = []
+            CLASS2 = []
+        
+        for idx, (file, data, header) in enumerate(read_sources(test_files)):
+            flx = data[0]
+            flx = flx[:self.wavelengths]
+            flx = flx/np.sum(flx)
+            CLS = header['CLASS']
+            if MK and CLS=='STAR': CLS = header['SUBCLASS'][0]
             flux2.append(flx)
             CLASS2.append(CLS)
                     
@@ -296,7 +335,8 @@ class Neural_Network:
         for i in range(self.cls):
             print(self.classes[i], ': ', np.sum([x[i] for x in CLA2]))
         
-    def train_lr(self, folder, train_steps, batch_frac, record):
+    @instrument.timed('fit')
+    def train_lr(self, folder, train_steps, batch_frac, record, stratified = False):
         'create a linear regressor neural net and train it on the data'
         x = tf.placeholder(tf.float32, shape = [None, self.wavelengths])
         y_ = tf.placeholder(tf.float32, shape = [None, self.cls])
@@ -317,27 +357,37 @@ class Neural_Network:
         
         confusion = tf.confusion_matrix(tf.argmax(y,1), tf.argmax(y_,1))
         
+        batches = self.batches(batch_frac, stratified)
+        
         with tf.Session() as sess:
             t = time.time()
             sess.run(tf.global_variables_initializer())
             for i in range(train_steps):
-                batch_x, batch_y = self.batch(batch_frac)
+                with instrument.span('batch'):
+                    batch_x, batch_y = next(batches)
                 if i%record == 0 and i != 0:
-                    train_accuracy = sess.run(accuracy, feed_dict={x: self.x_test, y_: self.y_test})
+                    with instrument.span('evaluate'):
+                        train_accuracy = sess.run(accuracy, feed_dict={x: self.x_test, y_: self.y_test})
                     print('step {} training accuracy {}'.format(i, train_accuracy))
                     accuracies.append([i, train_accuracy])
-                train_step.run(feed_dict={x: batch_x, y_: batch_y})
+                with instrument.span('train_step'):
+                    train_step.run(feed_dict={x: batch_x, y_: batch_y})
         
-            conf, acc = sess.run([confusion, accuracy], feed_dict={x: self.x_test, y_: self.y_test})
+            with instrument.span('evaluate'):
+                conf, acc = sess.run([confusion, accuracy], feed_dict={x: self.x_test, y_: self.y_test})
             print('test accuracy {}'.format(acc))
             print(conf)
             accuracies.append([i+1, acc])
             self.save(folder, conf, accuracies)
             print('training time: ', time.time() - t, 's')
         
-        plot_results(folder)
+        if self.train_shards is not None: batches.close()
+        
+        with instrument.span('plot'):
+            plot_results(folder)
         
-    def train_conv(self, folder, train_steps, batch_frac, keep=0.5, record=100, pw0=3, pw1=10, pw2=10, width1=50, width2=50, inter1=32, inter2=64, inter3=1000):
+    @instrument.timed('fit')
+    def train_conv(self, folder, train_steps, batch_frac, keep=0.5, record=100, pw0=3, pw1=10, pw2=10, width1=50, width2=50, inter1=32, inter2=64, inter3=1000, stratified=False, eval_samples=None, eval_chunk=1000):
         'create a convolutional neural net and train it on the data'
         
         f_wavs = self.wavelengths
@@ -345,7 +395,7 @@ class Neural_Network:
         for pw in [pw0, pw1, pw2]:
             f_wavs = int(np.ceil(f_wavs/pw))
         
-        x = tf.placeholder(tf.float32, shape = [None, self.wavelengths])
+        x = tf.placeholder(tf.float32, shape = [None, self.wavelengths], name = 'x')
         y_ = tf.placeholder(tf.float32, shape = [None, self.cls])
         
         
@@ -381,7 +431,7 @@ class Neural_Network:
         
         
         
-        keep_prob= tf.placeholder(tf.float32)
+        keep_prob= tf.placeholder(tf.float32, name = 'keep_prob')
         i_l4 = tf.nn.dropout(o_l3, keep_prob)
         
         W_l4 = self.weight_variable([inter3, self.cls])
@@ -389,42 +439,58 @@ class Neural_Network:
         
         y = tf.matmul(i_l4, W_l4) + b_l4
         
+        probabilities = tf.nn.softmax(y, name = 'probabilities')
+            #named, with x and keep_prob, so that classify.py can find them in the saved graph
+        
         
         cross_entropy = tf.reduce_mean(tf.nn.softmax_cross_entropy_with_logits(labels = y_, logits = y))
         
         train_step = tf.train.AdamOptimizer(1e-4).minimize(cross_entropy)
         
-        correct_prediction = tf.equal(tf.argmax(y,1), tf.argmax(y_,1))
-        accuracy = tf.reduce_mean(tf.cast(correct_prediction, tf.float32))
+        prediction = tf.argmax(y,1)
         
         accuracies = []
         
-        confusion = tf.confusion_matrix(tf.argmax(y,1), tf.argmax(y_,1))
+        evaluator = ChunkedEvaluator(self.x_test, self.y_test, self.cls, eval_chunk, eval_samples)
+            #periodic checks use a fixed subsample of eval_samples test spectra (all if None), the final check all of them
         
+        batches = self.batches(batch_frac, stratified)
+        
+        saver = tf.train.Saver()
         
         with tf.Session() as sess:
             t = time.time()
             ti =time.time()
             sess.run(tf.global_variables_initializer())
             for i in range(train_steps):
-                batch_x, batch_y = self.batch(batch_frac)
+                with instrument.span('batch'):
+                    batch_x, batch_y = next(batches)
                 if i%record == 0 and i != 0:
-                    train_accuracy = sess.run(accuracy, feed_dict={x: self.x_test, y_: self.y_test, keep_prob: 1.0})
+                    with instrument.span('evaluate'):
+                        train_accuracy = evaluator.evaluate(lambda xc: sess.run(prediction, feed_dict={x: xc, keep_prob: 1.0}))[0]
                     print('step {} training accuracy {}, {}s'.format(i, train_accuracy, time.time() - ti))
                     ti = time.time()
                     accuracies.append([i, train_accuracy])
-                train_step.run(feed_dict={x: batch_x, y_: batch_y, keep_prob: keep})
-            conf, acc, filter1, filter2, probs = sess.run([confusion, accuracy, W_l1, W_l2, y], feed_dict={x: self.x_test, y_: self.y_test, keep_prob: 1.0})
+                with instrument.span('train_step'):
+                    train_step.run(feed_dict={x: batch_x, y_: batch_y, keep_prob: keep})
+            with instrument.span('evaluate'):
+                acc, conf, pred = evaluator.evaluate(lambda xc: sess.run(prediction, feed_dict={x: xc, keep_prob: 1.0}), full = True)
+            filter1, filter2 = sess.run([W_l1, W_l2])
             print('test accuracy {}'.format(acc))
             print(conf)
             accuracies.append([i+1, acc])
             self.save(folder, conf, accuracies, filter1, filter2)
+            saver.save(sess, 'Files/' + folder + '/model.ckpt')
+                #checkpoint the trained network for classify.py
             print('training time: ', time.time() - t, 's')
         
-        plot_results(folder)
+        if self.train_shards is not None: batches.close()
+        
+        with instrument.span('plot'):
+            plot_results(folder)
 
         for i in range(len(self.file_test)):
-            if self.y_test[i][3] and np.argmax(probs[i])==1:
+            if self.y_test[i][3] and pred[i]==1:
                 print(self.file_test[i])
                 fig, ax = plt.subplots()
                 ax.plot(self.x_test[i])
@@ -1,13 +1,21 @@
 from astropy.io import fits
 import matplotlib.pyplot as plt
 
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Common'))
+from fits_index import build_index, select_files
+
 import glob
 
-files = glob.glob('/data2/cpb405/Training/*.fits')
+index = '/data2/cpb405/Training/index.db'
+
+if not os.path.isfile(index): build_index(glob.glob('/data2/cpb405/Training/*.fits'), index)
 
+files = select_files(index, CLASS='Unknown')
 
 for file in files:
     with fits.open(file) as hdulist:
-        if hdulist[0].header['CLASS'] == 'Unknown':
-            plt.plot(hdulist[0].data[0])
-            plt.show()
\ No newline at end of file
+        plt.plot(hdulist[0].data[0])
+        plt.show()
@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 
-import pandas as pd
 import scipy as sp
 #import matplotlib.pyplot as plt
 
@@ -9,8 +8,12 @@ from astropy.io import fits
 
 #import gc
 import glob
+import os
 import sys
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Common'))
+from feature_sink import FeatureSink
+
 if len(sys.argv) != 2:
     print('Usage : ./readfits.py index')
 index = int(sys.argv[1])
@@ -27,7 +30,10 @@ keys = ['designation', 'CLASS', 'filename'] + [feat[0] for feat in fBands.items(
 
 errors = sp.array([])
 
-for idx, fitsName in enumerate(files[index*batch:(index+1)*batch]):
+dr1 = FeatureSink('CSVs/spectra' + str(index) + '.csv', keys, strings = ['designation', 'CLASS', 'filename'], chunk = batch)
+start = dr1.resume()
+
+for idx, fitsName in enumerate(files[index*batch+start:(index+1)*batch]):
     
     hdulist = fits.open(fitsName)
 
@@ -85,17 +91,10 @@ for idx, fitsName in enumerate(files[index*batch:(index+1)*batch]):
                 values[i] = 0 #need to think of better fix
         i += 1
 
-    df = pd.DataFrame(columns=keys)
-
-    df.loc[0] = [hdulist[0].header['DESIG'][7:], hdulist[0].header['CLASS'], hdulist[0].header['FILENAME'], values[0], values[1], values[2], values[3], values[4], values[5], values[6], values[7]] #upgrade to using python 3 and use values* instead of individual indexing
-
-    if idx == 0:
-        dr1 = df.copy()
-    else:
-        dfr1 = pd.concat([dr1, df])
+    dr1.append([hdulist[0].header['DESIG'][7:], hdulist[0].header['CLASS'], hdulist[0].header['FILENAME'], *values])
 
     hdulist.close()
     
     #gc.collect()
 
-dr1.to_csv('CSVs/spectra' + str(index) + '.csv', index = False)
+dr1.close()
@@ -7,15 +7,17 @@ import seaborn as sns
 from sklearn.ensemble import RandomForestClassifier
 from sklearn import cross_validation
 
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Common'))
+from blackbody import blackbody as blackbody_curves
+
 #from fits import Spectra
 
 def blackbody(T):
-    wavelength = sp.linspace(3000, 9000, 3001)
-    h = 6.63e-34
-    c = 3e8
-    k = 1.38e-23
-    return (8*sp.pi*h*c)/((wavelength*1e-10)**5*(sp.exp(h*c/((wavelength*1e-10)*k*T))-1))
-	#calculate a blackboduy curve for a given temperature
+    return blackbody_curves(T, sp.linspace(3000, 9000, 3001))
+	#calculate normalised blackbody curves for a temperature or array of temperatures
 
 temp = sp.array(sp.random.normal(6000, 2000, 800))
 	#generate a normal distribution of tempratures
@@ -24,14 +26,11 @@ for i in range(len(temp)):
     temp[i] = int(int(temp[i]))
 	#convert the temperatures to (positive) integers for use in the algorithm
 
-colour = []
-
-for t in temp:
-    spectra = blackbody(t)
-    B = -2.5*sp.log10(sp.sum(spectra[490:960]))
-    V = -2.5*sp.log10(sp.sum(spectra[1035:1475]))
-    colour.append(B - V)
-	#for each temperature, generate a balckbody curve then calculate its colour features
+spectra = blackbody(temp)
+B = -2.5*sp.log10(sp.sum(spectra[:, 490:960], axis = 1))
+V = -2.5*sp.log10(sp.sum(spectra[:, 1035:1475], axis = 1))
+colour = B - V
+	#generate a blackbody curve for every temperature at once then calculate their colour features
 
 colour = sp.reshape(colour, (-1, 1))
 	#reshape the colour to a column vector for use in the algorithm
@@ -6,6 +6,11 @@ import matplotlib
 import matplotlib.pyplot as plt
 
 import glob
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'Common'))
+from blackbody import blackbody as blackbody_curves
 
 '''
 O 436
@@ -19,12 +24,7 @@ M 306
 
 def blackbody(wavelength, T):
     'create a black body spectrum at temperature t and normalise it'
-    h = 6.63e-34
-    c = 3e8
-    k = 1.38e-23
-    
-    spec = ((8*sp.pi*h*c)/((wavelength*1e-10)**5*(sp.exp(h*c/((wavelength*1e-10)*k*T))-1)))/(T*55.8)
-    return spec/sp.sum(spec)
+    return blackbody_curves(T, wavelength)[0]
     
 #matplotlib.rcParams.update({'font.size': 22})
 
@@ -1,33 +1,38 @@
 #!/usr/bin/env python3
 
-from astropy.io import fits
 import scipy as sp
 import matplotlib.pyplot as plt
-from astropy.convolution import convolve, Box1DKernel
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Common'))
+from features import boxcar_smooth
+from blackbody import blackbody
+from lamost_fits import read_rows, FLUX
 
 class Spectrum:
     #a class to read and store information from the .fits files of DR1 spectra
     def __init__(self, path):
-        #takes the file path of the .fits file as an argument
+        #takes the file path of the .fits (or .fits.gz) file, or a member of a tar archive from spectrum_sources, as an argument
         
         width = 10 #not decided on value yet
         
-        hdulist = fits.open(path)
-            #open the .fits file to allow for data access
-        self.flux = hdulist[0].data[0]  #flux counts of the spectra
-        self.date = hdulist[0].header['DATE']   #date the observation was made
+        data, header = read_rows(path, [FLUX])
+            #read the flux row and the header cards of the .fits file
+        self.flux = data[0]  #flux counts of the spectra
+        self.date = header['DATE']   #date the observation was made
 
-        self.CLASS = hdulist[0].header['CLASS'] #object LAMOST classification
+        self.CLASS = header['CLASS'] #object LAMOST classification
         
-        self.smoothFlux = convolve(self.flux,Box1DKernel(width))[5*width:-5*width]
+        self.smoothFlux = boxcar_smooth(self.flux, [width])[0][0][5*width:-5*width]
         
-        self.desig = hdulist[0].header['DESIG'][7:] #Designation of the object
+        self.desig = header['DESIG'][7:] #Designation of the object
         
         self.totCounts = sp.sum(self.flux)  #Sum the total counts to give a feature
         	
-        init = hdulist[0].header['COEFF0']
+        init = header['COEFF0']
             #coeff0 is the centre point of the first point in log10 space
-        disp = hdulist[0].header['COEFF1']
+        disp = header['COEFF1']
             #coeff1 is the seperation between points in log10 space
         
         self.wavelength = 10**sp.arange(init, init+disp*(len(self.flux)-0.9), disp)[5*width:-5*width]
@@ -35,8 +40,6 @@ class Spectrum:
         
         self.flux = self.flux[5*width: -5*width]
         
-        hdulist.close()
-            #close the .fits file
         self.lines = {'Iron':[3800, 3900]}
             #elements, and the window in which their emmision lines are seen 
         self.letters = {"B":[3980,4920], "V":[5070,5950],"R":[5890,7270],"I":[7310,8810]}
@@ -67,33 +70,15 @@ class Spectrum:
         ax.plot(self.wavelength,self.flux, color = colour, label = label)
         
         if Tpred:
-            h = 6.63e-34
-            c = 3e8
-            k = 1.38e-23
-            
-            E = (8*sp.pi*h*c)/((self.wavelength*1e-10)**5*(sp.exp(h*c/((self.wavelength*1e-10)*k*Tpred))-1))
-            #Calculate an ideal black body curve for a temperature T
-
-            fudge = self.totCounts/sp.sum(E)
-                #normalise blackbody curve by scaling by the total counts ratio of the curve to the spectra        
-            self.bbFlux = fudge*E
-                #the normalised blackbody curve
+            self.bbFlux = blackbody(Tpred, self.wavelength, self.totCounts)[0]
+                #ideal black body curve for the temperature, normalised to the total counts of the spectra
             
             ax.plot(self.wavelength,self.bbFlux, ls = '--', label = 'Predicted', color = 'r')
                 #plot the flux and blackbody curve against wavelength
         
         if Teff:
-            h = 6.63e-34
-            c = 3e8
-            k = 1.38e-23
-            
-            E = (8*sp.pi*h*c)/((self.wavelength*1e-10)**5*(sp.exp(h*c/((self.wavelength*1e-10)*k*Teff))-1))
-            #Calculate an ideal black body curve for a temperature T
-
-            fudge = self.totCounts/sp.sum(E)
-                #normalise blackbody curve by scaling by the total counts ratio of the curve to the spectra        
-            self.bbFlux = fudge*E
-                #the normalised blackbody curve
+            self.bbFlux = blackbody(Teff, self.wavelength, self.totCounts)[0]
+                #ideal black body curve for the temperature, normalised to the total counts of the spectra
             
             ax.plot(self.wavelength,self.bbFlux, ls = ':', label = 'Effective', color = 'g')
                 #plot the flux and blackbody curve against wavelength
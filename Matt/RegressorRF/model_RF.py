@@ -15,45 +15,66 @@ from sklearn.model_selection import GridSearchCV
 
 import time
 import matplotlib
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Common'))
+from catalog_store import CatalogJoin
+from features import pairwise_features
+from rf_model import RegressorBundle, MultiTargetForest, load_bundle, predict_features
+from rf_tuning import HalvingSearch
+import instrument
 
 matplotlib.rcParams.update({'font.size': 22})
 
+if len(sys.argv) in [4, 5]:
+    predict_features(load_bundle(sys.argv[1]), sys.argv[2], sys.argv[3], n_jobs = int(sys.argv[4]) if len(sys.argv) == 5 else -1)
+    sys.exit()
+        #./model_RF.py Files/model_RF.pkl features.csv output.csv [n_jobs] predicts a survey with a saved model
+
 bright = 1000
     #number/fraction of stars to include, starting at brightest (set to False to include all)
+halving = True
+    #tune by successive halving with warm-started forests (set to False for the exhaustive grid search)
+multi = False
+    #fit one forest per parameter (set to True to fit one forest predicting all the parameters at once, with permutation importances)
 
 cfile = '/data2/cpb405/dr1_stellar.csv'
-catalog = pd.read_csv(cfile, sep='|')
-catalog.drop_duplicates(subset = 'designation', inplace = True)
+join = CatalogJoin(cfile, ['designation', 'teff', 'logg', 'feh'])
     
 sfile = 'Files/spectra2.csv'    ###filename###
 
-spec = pd.read_csv(sfile, sep=',')
-
-df = catalog.merge(spec, on='designation', how='inner')
-
-if bright and bright%1==0: df = df.sort_values('total', ascending = False)[:bright]
-elif bright and bright <= 1: df = df.sort_values('total', ascending = False)[:int(bright*len(df['designation']))]
+if bright and bright%1==0: df = join.merge(sfile, sort = 'total', ascending = False, limit = bright)
+else:
+    df = join.merge(sfile)
+    if bright and bright <= 1: df = df.sort_values('total', ascending = False)[:int(bright*len(df['designation']))]
+join.report()
 
 #
-features = sp.array(df.columns[39:])
+first = len(join.columns) + 2
+    #spectral features follow the catalog columns and CLASS, filename
+features = sp.array(df.columns[first:])
 colours = features[sp.array([feat[0]=='c' for feat in features])]
 lines = features[sp.array([feat[0]=='l' for feat in features])]
 
-imputer = Imputer(missing_values = 0)
-df[features] = imputer.fit_transform(df[features])
-
-for idx in range(len(colours)-1):
-    for j in sp.arange(idx+1, len(colours)):
-        df[colours[idx][1:] + '-' + colours[j][1:]] = df.loc[:,colours[idx]] - df.loc[:,colours[j]]
-
-for idx in range(len(lines)-1):
-    for j in sp.arange(idx+1, len(lines)):
-        df[lines[idx][1:] + '/' + lines[j][1:]] = df.loc[:,lines[idx]]/df.loc[:,lines[j]]
+instrument.count('features_imputed', int((df[features].values == 0).sum()))
+    #missing features, replaced by the imputer
 
-features = sp.array(df.columns[39:])
+with instrument.span('features'):
+    imputer = Imputer(missing_values = 0)
+    df[features] = imputer.fit_transform(df[features])
+    
+    diffs, diff_names = pairwise_features(df[colours].values, colours, '-')
+    ratios, ratio_names = pairwise_features(df[lines].values, lines, '/')
+        #every colour difference and line ratio, built as one matrix each
+    
+    scaler = StandardScaler()
+    scaled = scaler.fit_transform(sp.hstack((df[features].values, diffs, ratios)))
 
-scaler = StandardScaler()
-df[features] = scaler.fit_transform(df[features])
+df = df.drop(columns = features)
+base = features
+features = sp.append(features, diff_names + ratio_names)
+df = pd.concat([df, pd.DataFrame(scaled, columns = features, index = df.index)], axis = 1)
 
 #
 
@@ -66,8 +87,27 @@ parameter_grid = [{'n_estimators':[20,40,60,80,100],'max_depth':[1000,2000,3000,
 
 #parameters = ['teff', 'logg', 'feh']
 parameters = ['logg']
+models = {}
 
-for parameter in parameters:
+if multi:
+    t = time.time()
+    Y = df[parameters].values
+    if halving: regr = HalvingSearch(parameter_grid)
+    else: regr = GridSearchCV(RandomForestRegressor(), parameter_grid, n_jobs = -1)
+    with instrument.span('tune'): regr.fit(df[features], (Y - Y.mean(axis = 0))/Y.std(axis = 0))
+        #tune on standardised targets, as the multi-output forest is fitted
+    hyp = regr.best_params_
+    print(hyp)
+    
+    clf = MultiTargetForest(parameters, n_estimators=hyp['n_estimators'],max_depth=hyp['max_depth'],max_features = hyp['max_features'])
+    with instrument.span('fit'): clf.fit(X_train, train[parameters].values)
+    models[tuple(parameters)] = clf
+    with instrument.span('predict'): multi_final = clf.predict(X_test)
+    with instrument.span('importances'): multi_importances = clf.target_importances(X_test, test[parameters].values)
+        #one fit and one prediction for every parameter, with the importances of each
+    print(time.time() - t)
+
+for idx, parameter in enumerate(parameters):
     t = time.time()
     print(parameter)
     y_train = train[parameter].tolist()
@@ -75,27 +115,35 @@ for parameter in parameters:
     
     ends = [sp.amin(y_test), sp.amax(y_test)]
     
-    #
-    regr = GridSearchCV(RandomForestRegressor(), parameter_grid)
-    regr.fit(df[features], df[parameter].tolist())
-    hyp = regr.best_params_
-    print(hyp)
-    #
-    
-    clf = RandomForestRegressor(n_estimators=hyp['n_estimators'],max_depth=hyp['max_depth'],max_features = hyp['max_features'])
-
-    
-    clf.fit(X_train, y_train)
-        #fit the model the the current training set
+    if multi:
+        final = multi_final[:, idx]
+        importances = multi_importances[:, idx]
+    else:
+        #
+        if halving: regr = HalvingSearch(parameter_grid)
+        else: regr = GridSearchCV(RandomForestRegressor(), parameter_grid, n_jobs = -1)
+        with instrument.span('tune'): regr.fit(df[features], df[parameter].tolist())
+        hyp = regr.best_params_
+        print(hyp)
+        #
+        
+        clf = RandomForestRegressor(n_estimators=hyp['n_estimators'],max_depth=hyp['max_depth'],max_features = hyp['max_features'])
     
-    final = clf.predict(X_test)
-        #Use the model to predict the temperatures of the test set
+        
+        with instrument.span('fit'): clf.fit(X_train, y_train)
+            #fit the model the the current training set
+        models[parameter] = clf
+        
+        with instrument.span('predict'): final = clf.predict(X_test)
+            #Use the model to predict the temperatures of the test set
+        importances = clf.feature_importances_
     
     error = final - y_test
         #calculate the error of the fit
     
     MAD = stats.mad_std(error)
         #calculate the MAD of the data
+    print('MAD : {:.3f}'.format(MAD))
     
     fig, ax = plt.subplots(2,2, figsize=(18,12))
     
@@ -123,7 +171,7 @@ for parameter in parameters:
             fea[f] = features[f][1:]
         else: fea[f] = features[f]
     
-    imp = [[x,y] for x,y in sorted(zip(clf.feature_importances_, fea), reverse = True)]
+    imp = [[x,y] for x,y in sorted(zip(importances, fea), reverse = True)]
     
     bp = sns.barplot([i[1] for i in imp][:hyp['max_features']], [i[0]  for i in imp][:hyp['max_features']], ax = ax[1][0])
     ax[1][0].set_xlabel('Features')
@@ -137,7 +185,7 @@ for parameter in parameters:
     '''
     test_index = sp.argmax(abs(error))
     
-    spectrum = Spectrum('/data2/mrs493/DR1_3/' + test.filename.tolist()[test_index])    ###filename###
+    with instrument.span('read'): spectrum = Spectrum('/data2/mrs493/DR1_3/' + test.filename.tolist()[test_index])    ###filename###
     
     ax[1][1].set_xlabel('Wavelength \ Angstroms')
     ax[1][1].set_ylabel('Flux')
@@ -147,9 +195,13 @@ for parameter in parameters:
         ax[1][1].legend()
     else: spectrum.plotFlux(ax = ax[1][1], label = 'Outlier', log = False)
         
-    plt.tight_layout()
-    if bright: plt.savefig('Figures/Fe' + parameter + 'Model' + str(bright) + 'B.pdf')
-    else: plt.savefig('Figures/Fe' + parameter + 'Model.pdf')
+    with instrument.span('plot'):
+        plt.tight_layout()
+        if bright: plt.savefig('Figures/Fe' + parameter + 'Model' + str(bright) + 'B.pdf')
+        else: plt.savefig('Figures/Fe' + parameter + 'Model.pdf')
     print(time.time() - t)
 
+with instrument.span('save'): RegressorBundle(imputer, scaler, base, colours, lines, models).save('Files/model_RF.pkl')
+    #keep everything needed to predict from a new feature table
+
 plt.show()
@@ -12,6 +12,14 @@ from sklearn.ensemble import RandomForestRegressor, AdaBoostRegressor
 from sklearn.neighbors import KNeighborsRegressor, RadiusNeighborsRegressor
 from sklearn.linear_model import LinearRegression, HuberRegressor, RANSACRegressor, TheilSenRegressor
 from sklearn.gaussian_process import GaussianProcessRegressor
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Common'))
+from catalog_store import CatalogJoin
+from features import pairwise_features
+from regressor_comparison import compare_regressors
 '''
 def getFeatures(df):
     B = sp.array(df["B"].tolist())
@@ -44,40 +52,40 @@ y_test = test.teff.tolist()
 
 bright = 1000
     #number/fraction of stars to include, starting at brightest (set to False to include all)
+budget = 600
+    #seconds allowed for each model to fit and predict before it is abandoned
 
 cfile = '/data2/cpb405/dr1_stellar.csv'
-catalog = pd.read_csv(cfile, sep='|')
-catalog.drop_duplicates(subset = 'designation', inplace = True)
+join = CatalogJoin(cfile, ['designation', 'teff', 'logg', 'feh'])
     
 sfile = 'Files/spectra2.csv'    ###filename###
 
-spec = pd.read_csv(sfile, sep=',')
-
-df = catalog.merge(spec, on='designation', how='inner')
-
-if bright and bright%1==0: df = df.sort_values('total', ascending = False)[:bright]
-elif bright and bright <= 1: df = df.sort_values('total', ascending = False)[:int(bright*len(df['designation']))]
+if bright and bright%1==0: df = join.merge(sfile, sort = 'total', ascending = False, limit = bright)
+else:
+    df = join.merge(sfile)
+    if bright and bright <= 1: df = df.sort_values('total', ascending = False)[:int(bright*len(df['designation']))]
+join.report()
 
 #
-features = sp.array(df.columns[39:])
+first = len(join.columns) + 2
+    #spectral features follow the catalog columns and CLASS, filename
+features = sp.array(df.columns[first:])
 colours = features[sp.array([feat[0]=='c' for feat in features])]
 lines = features[sp.array([feat[0]=='l' for feat in features])]
 
 imputer = Imputer(missing_values = 0)
 df[features] = imputer.fit_transform(df[features])
 
-for idx in range(len(colours)-1):
-    for j in sp.arange(idx+1, len(colours)):
-        df[colours[idx][1:] + '-' + colours[j][1:]] = df.loc[:,colours[idx]] - df.loc[:,colours[j]]
-
-for idx in range(len(lines)-1):
-    for j in sp.arange(idx+1, len(lines)):
-        df[lines[idx][1:] + '/' + lines[j][1:]] = df.loc[:,lines[idx]]/df.loc[:,lines[j]]
-
-features = sp.array(df.columns[39:])
+diffs, diff_names = pairwise_features(df[colours].values, colours, '-')
+ratios, ratio_names = pairwise_features(df[lines].values, lines, '/')
+    #every colour difference and line ratio, built as one matrix each
 
 scaler = StandardScaler()
-df[features] = scaler.fit_transform(df[features])
+scaled = scaler.fit_transform(sp.hstack((df[features].values, diffs, ratios)))
+
+df = df.drop(columns = features)
+features = sp.append(features, diff_names + ratio_names)
+df = pd.concat([df, pd.DataFrame(scaled, columns = features, index = df.index)], axis = 1)
 
 #
 
@@ -91,35 +99,34 @@ parameters = ['teff', 'logg', 'feh']
 names = ['KNeighbours', 'Radius Neighbors', 'Random Forest', 'Linear Regression', 'Gaussian Process', 'Ada Boost', 'Huber', 'RANSAC', 'Theil-Sen', ]
 classifiers = [KNeighborsRegressor(), RadiusNeighborsRegressor(), RandomForestRegressor(), LinearRegression(), GaussianProcessRegressor(), AdaBoostRegressor(), HuberRegressor(), RANSACRegressor(), TheilSenRegressor()]
 
+table, predictions = compare_regressors(dict(zip(names, classifiers)), X_train, train[parameters].values, X_test, test[parameters].values, parameters, budget = budget)
+    #fit every model to every parameter in parallel worker processes, recording time, memory and MAD
+print(table.to_string())
+table.to_csv('Files/regressor_comparison.csv', index = False)
+
 for parameter in parameters:
     print(parameter)
-    y_train = train[parameter].tolist()
     y_test = test[parameter].tolist()
 
     ends = [sp.amin(y_test), sp.amax(y_test)]
     
     fig, ax = plt.subplots(nrows = 3, ncols = 3, sharex = True)
+    fig.suptitle(parameter + ' Regressor Comparison')
     
     for i in range(len(classifiers)):
         
-        clf = classifiers[i]
-        
-        clf = clf.fit(X_train, y_train)
-            #fit the model the the current training set
-        
-        final = clf.predict(X_test)
-            #Use the model to predict the temperatures of the test set
-        
-        fig.suptitle(parameter + ' Regressor Comparison')
+        ax.flat[i].set_title(names[i])
+        if (names[i], parameter) not in predictions:
+            ax.flat[i].annotate(table.status[(table.model == names[i]) & (table.target == parameter)].values[0], xy = (0.05, 0.90), xycoords = 'axes fraction', color = 'red')
+            continue
+            #timed out or failed
         
-        error = final - y_test
-            #calculate the error of the fit
+        final = predictions[(names[i], parameter)]
         
-        MAD = stats.mad_std(error)
+        MAD = stats.mad_std(final - y_test)
     
         ax.flat[i].scatter(y_test, final)
         ax.flat[i].plot(ends, ends, ls = ':', color = 'red')
-        ax.flat[i].set_title(names[i])
         ax.flat[i].annotate('MAD = {0:.2f}'.format(MAD), xy = (0.05, 0.90), xycoords = 'axes fraction', color = 'red')
         
     if bright: plt.savefig('Figures/regressor_' + parameter + '_comparison_' + str(bright) + 'B.pdf')